@@ -213,8 +213,10 @@ def run(options):
     results = doc.select("table p > a[href]")
     if not results:
       raise inspector.NoReportsFoundError("ARC (%s)" % report_type)
-    for result in results:
-      report = report_from(result, url, report_type, year_range)
+    # undated reports are dated with a HEAD request, make those side by side
+    reports = inspector.resolve_landing_pages(
+      results, lambda result: report_from(result, url, report_type, year_range))
+    for report in reports:
       if report:
         inspector.save_report(report)
 
@@ -249,12 +251,7 @@ def report_from(result, landing_url, report_type, year_range):
       pass
 
   if not published_on:
-    try:
-      response = utils.scraper.request(method="HEAD", url=report_url)
-      last_modified = response.headers["Last-Modified"]
-      published_on = datetime.datetime.strptime(last_modified, "%a, %d %b %Y %H:%M:%S %Z")
-    except ValueError:
-      pass
+    published_on = utils.last_modified([report_url])[report_url]
 
   if not published_on:
     admin.log_no_date("arc", report_id, title, report_url)
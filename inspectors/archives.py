@@ -150,8 +150,10 @@ def run(options):
     results = doc.select("div.region-content li") or doc.select("div.region-content p")
     if results:
       results_flag = True
-    for result in results:
-      report = audit_report_from(result, url, year, year_range)
+    # undated reports are dated with a HEAD request, make those side by side
+    reports = inspector.resolve_landing_pages(
+      results, lambda result: audit_report_from(result, url, year, year_range))
+    for report in reports:
       if report:
         inspector.save_report(report)
 
@@ -215,12 +217,7 @@ def audit_report_from(result, landing_url, year, year_range):
       pass
 
   if not published_on:
-    try:
-      response = utils.scraper.request(method="HEAD", url=report_url)
-      last_modified = response.headers["Last-Modified"]
-      published_on = datetime.datetime.strptime(last_modified, "%a, %d %b %Y %H:%M:%S %Z")
-    except ValueError:
-      pass
+    published_on = utils.last_modified([report_url])[report_url]
 
   if not published_on:
     admin.log_no_date("archives", report_id, title, report_url)
@@ -156,16 +156,26 @@ def run(options):
     page = utils.beautifulsoup_from_url(url)
 
     report_table = page.select('table[summary~="reports"]')[0]
+    rows = []
     for tr in report_table.select('tr')[1:]:
       tds = tr.select('td')
       if len(tds) == 1:
         # Page has no reports, simply a "No Data" indication for these dates.
         break
-      report = report_from(tds, options)
+      rows.append(tds)
+
+    # each report needs its landing page, fetch a page's worth at a time
+    reports = inspector.resolve_landing_pages(
+      rows, lambda tds: report_from(tds, options), landing_url_for)
+    for report in reports:
       if report:
         inspector.save_report(report)
 
 
+def landing_url_for(tds):
+  return urljoin(BASE_URL, tds[2].select('a')[0]['href'])
+
+
 def report_from(tds, options):
   report = {
     'inspector': 'dod',
@@ -176,7 +186,7 @@ def report_from(tds, options):
 
   title_link = tds[2].select('a')[0]
   title = title_link.text.strip().replace('\r\n', ' ')
-  landing_url = urljoin(BASE_URL, title_link['href'])
+  landing_url = landing_url_for(tds)
 
   if landing_url in LANDING_PAGE_BLACKLIST:
     return
@@ -22,9 +22,6 @@ archive = 1994
 #   component - Any of the slugs in the `components` dict below,
 #               will be used to filter to a particular landing page.
 
-# accumulates information on reports as they're seen
-report = {}
-
 base_url = "https://oig.justice.gov/reports/"
 
 # just here for developer reference, valid component URL slugs to filter on
@@ -77,7 +74,7 @@ YEAR_RE = re.compile("^(?:19|20)[0-9][0-9]/(.*)$")
 AG_RE = re.compile("http://www[.]justice[.]gov/archive/ag/annualreports/([^/]+)/(?:TableofContents|index)[.]html?")
 
 
-def extract_info(content, directory, year_range):
+def extract_info(content, directory, year_range, reports):
   # goes through each agency or content bucket
   if directory in not_agency:
     agency = "doj"
@@ -275,64 +272,51 @@ def extract_info(content, directory, year_range):
           # print("Skipping report for %s..." % report_year)
           continue
 
-        if doc_id in report:
-          if file_type == "pdf":
-            # current and previous file pdf
-            if report[doc_id]["file_type"] == "pdf":
-              report[doc_id]["categories"].append(directory)
-            # current file a pdf, old file html
-            else:
-              report[doc_id]["file_type"] = "pdf"
-              report[doc_id]["url"] = link
-              report[doc_id]["categories"].append(directory)
-          else:
-            # current file html old file pdf OR both files html
-            report[doc_id]["categories"].append(directory)
-
-          # add url if new
-          old_url = False
-          for n in report[doc_id]["urls"]:
-            if link in n:
-              old_url = True
-          if not old_url:
-            report[doc_id]["urls"].append({
+        reports.add({
+          "report_id": doc_id,
+          "inspector": "doj",
+          "inspector_url": "https://oig.justice.gov/reports/",
+          "agency": agency,
+          "agency_name": agency_name,
+          "url": link,
+          "title": title,
+          "file_type": file_type,
+          "categories": [directory],
+          "urls": [{
               "url": link,
               "file_type": file_type,
               "indexed": indexed,
-            })
-
-          # finding the most descriptive name for cross-listed docs
-          if report[doc_id]["agency"] == "doj" and agency != "doj":
-            report[doc_id]["agency"] = agency
-            report[doc_id]["agency_name"] = agency_name
-
-        # Adding new document
-        else:
-          report[doc_id] = {
-            "report_id": doc_id,
-            "inspector": "doj",
-            "inspector_url": "https://oig.justice.gov/reports/",
-            "agency": agency,
-            "agency_name": agency_name,
-            "url": link,
-            "title": title,
-            "file_type": file_type,
-            "categories": [directory],
-            "urls": [{
-                "url": link,
-                "file_type": file_type,
-                "indexed": indexed,
-            }],
-            "published_on": published_on,
-            # perhaps elaborate on this later
-            "type": type_for(title),
-            "language": language,
-          }
+          }],
+          "published_on": published_on,
+          # perhaps elaborate on this later
+          "type": type_for(title),
+          "language": language,
+        })
 
   if report_count == 0:
     raise inspector.NoReportsFoundError("DOJ (%s)" % directory)
 
 
+# Combines another listing of the same document into what's known about it.
+def merge_reports(existing, report):
+  # prefer the PDF version of a document, if it's listed as both
+  if report["file_type"] == "pdf" and existing["file_type"] != "pdf":
+    existing["file_type"] = "pdf"
+    existing["url"] = report["url"]
+  existing["categories"].extend(report["categories"])
+
+  # add url if new
+  known_urls = [n["url"] for n in existing["urls"]]
+  for n in report["urls"]:
+    if n["url"] not in known_urls:
+      existing["urls"].append(n)
+
+  # finding the most descriptive name for cross-listed docs
+  if existing["agency"] == "doj" and report["agency"] != "doj":
+    existing["agency"] = report["agency"]
+    existing["agency_name"] = report["agency_name"]
+
+
 def strip_url_fragment(url):
   scheme, netloc, path, params, query, fragment = urlparse(url)
   return urlunparse((scheme, netloc, path, params, query, ""))
@@ -520,13 +504,25 @@ def run(options):
   keys = list(source_links.keys())
   keys.sort()
 
-  for link in keys:
-    content = get_content(link)
-    extract_info(content, source_links[link], year_range)
-
-  logging.info("Found %i reports, for year %i to %i" % (len(list(report.keys())), year_range[0], year_range[-1]))
-
-  for key in list(report.keys()):
-    inspector.save_report(report[key])
+  # Documents are cross-listed under several components, and are saved once
+  # after the crawl. A PDF is never replaced by a later listing (HTML ones
+  # may be), so those can be downloaded right away.
+  # --resume picks up from the component the last run was crawling.
+  checkpoint = inspector.checkpoint(options)
+  reports = inspector.ReportBuffer(lambda report: report["report_id"], merge_reports,
+                                   prefetch=lambda report: report["file_type"] == "pdf",
+                                   checkpoint=checkpoint)
+  if checkpoint.get("stage") != "saving":
+    for link in keys:
+      if link < checkpoint.get("component", ""):
+        continue
+      reports.checkpoint(component=link)
+      content = get_content(link)
+      extract_info(content, source_links[link], year_range, reports)
+    reports.checkpoint(stage="saving")
+
+  count = reports.finish()
+  checkpoint.done()
+  logging.info("Found %i reports, for year %i to %i" % (count, year_range[0], year_range[-1]))
 
 utils.run(run) if (__name__ == "__main__") else None
@@ -102,8 +102,10 @@ class EnergyScraper(object):
     self.first_date = datetime.datetime(self.year_range[0], 1, 1)
     self.last_date = datetime.datetime(self.year_range[-1], 12, 31)
 
+    # urls_for() has usually just fetched each of these pages to read its
+    # pagination links, so reuse them instead of downloading them again
     for url in self.urls_for():
-      page = utils.beautifulsoup_from_url(url)
+      page = utils.beautifulsoup_from_url(url, shared_tree=True)
 
       nodes = page.select('.energy-listing__results .node')
       if not nodes:
@@ -113,14 +115,18 @@ class EnergyScraper(object):
       if not nodes:
         raise inspector.NoReportsFoundError("Department of Energy (%s)" % url)
 
-      for node in nodes:
-        report = self.report_from(node)
+      reports = inspector.resolve_landing_pages(nodes, self.report_from,
+                                                self.landing_url_for)
+      for report in reports:
         if report:
           inspector.save_report(report)
         else:
           # Empty report indicates a report out of the date range, or not the ID.
           continue
 
+  def landing_url_for(self, node):
+    return urljoin(BASE_URL, node.select('.title-link')[0]['href'])
+
   def report_from(self, node):
     report = {
       'inspector': 'energy',
@@ -267,7 +273,7 @@ class EnergyScraper(object):
           # Next, read all the pagination links for the page and yield those. So
           # far, I haven't seen a page that doesn't have all of the following
           # pages enumerated.
-          next_page = utils.beautifulsoup_from_url(next_url)
+          next_page = utils.beautifulsoup_from_url(next_url, shared_tree=True)
           for link in next_page.select('li.pager-item a'):
             yield urljoin(BASE_URL, link['href'])
 
@@ -283,14 +289,14 @@ class EnergyScraper(object):
       last_page = False
 
       url = TOPIC_TO_URL[topic]
-      page = utils.beautifulsoup_from_url(url)
+      page = utils.beautifulsoup_from_url(url, shared_tree=True)
       page_started = self.is_first_page(page)
       if page_started:
         yield url
 
       for link in page.select('li.pager-item a'):
         next_url = urljoin(url, link['href'])
-        next_page = utils.beautifulsoup_from_url(next_url)
+        next_page = utils.beautifulsoup_from_url(next_url, shared_tree=True)
         if not page_started:
           page_started = self.is_first_page(next_page)
         if page_started:
@@ -5,6 +5,7 @@ import logging
 import json
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin
 
 from utils import utils, inspector, admin
@@ -50,12 +51,20 @@ http://www.gao.gov/browse/agency/Executive
 
 
 def run(options):
-
-  scrape_reports(options)
+  # a --since=1970 run takes many hours, see --resume
+  checkpoint = inspector.checkpoint(options)
+  if checkpoint.get("stage") != "restricted":
+    scrape_reports(options, checkpoint)
+    checkpoint.save(stage="restricted")
   scrape_restricted_reports(options)
+  checkpoint.done()
+
+
+# API lookups for the rows of a listing page are made this many at a time
+API_WORKERS = 4
 
 
-def scrape_reports(options):
+def scrape_reports(options, checkpoint):
   """Pull reports from "Reports and Testimonies - Browse by date" web page."""
 
   REPORTS_URL = 'http://www.gao.gov/browse/date/custom?adv_begin_date=01/01/' +\
@@ -67,27 +76,44 @@ def scrape_reports(options):
   # General Accounting Office back then and less oversighty.
 
   year_range = inspector.year_range(options, archive)
-  for year in year_range:
-    is_next_page = True
-    offset = 0
-    while is_next_page:
-      doc = utils.beautifulsoup_from_url(
-        REPORTS_URL % (year, year, offset))
-      results = doc.select("div.listing")
-      for result in results:
-        report = process_report(result, year_range)
-        if report:
-          inspector.save_report(report)
-      page_links = doc.select("a.non-current_page")
-      if len(page_links) and page_links[-1].text.startswith('Next'):
+
+  # While one listing page's reports are looked up and saved, the next
+  # listing page is fetched in the background.
+  resume_year = checkpoint.get("year")
+  with ThreadPoolExecutor(max_workers=1) as prefetcher:
+    for year in year_range:
+      if resume_year and (year < resume_year):
+        continue
+      offset = checkpoint.get("offset", 0) if (year == resume_year) else 0
+      next_doc = prefetcher.submit(fetch_listing, REPORTS_URL % (year, year, offset))
+      while next_doc:
+        doc = next_doc.result()
+        next_doc = None
+        checkpoint.save(year=year, offset=offset)
+
+        page_links = doc.select("a.non-current_page")
         offset += 50
-      else:
-        is_next_page = False
+        if len(page_links) and page_links[-1].text.startswith('Next'):
+          next_doc = prefetcher.submit(fetch_listing, REPORTS_URL % (year, year, offset))
+
+        listings = [listing_from(result, year_range) for result in doc.select("div.listing")]
+        listings = [listing for listing in listings if listing]
+        details = utils.map_concurrently(fetch_api_details, listings, workers=API_WORKERS)
+        for listing, listing_details in zip(listings, details):
+          report = process_report(listing, listing_details)
+          if report:
+            inspector.save_report(report)
+
 
+# wrapped so that fetches from the prefetch thread are attributed to this
+# scraper, see utils.beautifulsoup_from_url
+def fetch_listing(url):
+  return utils.beautifulsoup_from_url(url)
 
-def process_report(result, year_range):
 
-  """Use the report ID obtained from HTML to hit GAO's API"""
+def listing_from(result, year_range):
+  """Read a report's details from its row on a listing page, and work out the
+  URL with the rest of its details in GAO's API."""
   # <a href="/assets/690/685452.pdf">View Report (PDF, 8 pages)</a>
   # 685452 is the ID used by the API.
 
@@ -136,11 +162,30 @@ def process_report(result, year_range):
     logging.debug("[%s] No landing URL or PDF, skipping..." % api_id)
     return None
 
-  api_url = "http://www.gao.gov/api/id/%s" % api_id
-  json_response = json.loads(utils.download(api_url))
+  return {
+    'landing_url': landing_url,
+    'report_number': report_number,
+    'title': title,
+    'description': description,
+    'published_on': published_on,
+    'report_url': report_url,
+    'highlights_url': highlights_url,
+    'accessible_url': accessible_url,
+    'api_url': "http://www.gao.gov/api/id/%s" % api_id,
+  }
+
+
+def fetch_api_details(listing):
+  json_response = json.loads(utils.download(listing['api_url'], scraper_slug="gaoreports"))
   if not json_response:
     return None
-  details = json_response[0]
+  return json_response[0]
+
+
+def process_report(listing, details):
+  """Combine a report's listing row with its details from GAO's API"""
+  if not details:
+    return None
 
   """looks like this {
     "youtube_id": null,
@@ -173,6 +218,7 @@ def process_report(result, year_range):
     "description_short": ""
     },"""
 
+  accessible_url = listing['accessible_url']
   if 'html_url' in details:
     accessible_url = details['html_url']
   categories = details.get('topics', None)
@@ -196,23 +242,23 @@ def process_report(result, year_range):
     # We'll just have GAO for the inspector and the agency.
     'agency': 'gao',
     'agency_name': 'Government Accountability Office',
-    'report_id': report_number,
-    'landing_url': landing_url,
-    'url': report_url,
-    'title': title,
+    'report_id': listing['report_number'],
+    'landing_url': listing['landing_url'],
+    'url': listing['report_url'],
+    'title': listing['title'],
     'type': details['document_type'],
-    'published_on': datetime.datetime.strftime(published_on, "%Y-%m-%d"),
+    'published_on': datetime.datetime.strftime(listing['published_on'], "%Y-%m-%d"),
 
-    'highlights_url': highlights_url,
+    'highlights_url': listing['highlights_url'],
     'accessible_url': accessible_url,
-    'description': description,
+    'description': listing['description'],
     'categories': categories,
     'category_img': details['category_img'],
     'category_img_alt': details['category_img_alt'],
     'subsite': details['subsite']
   }
 
-  if not report_url:
+  if not listing['report_url']:
     report['unreleased'] = True
 
   return report
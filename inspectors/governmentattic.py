@@ -153,6 +153,7 @@ def run(options):
     category_name = remove_linebreaks(category_link.text).strip()
     doc = utils.beautifulsoup_from_url(category_link['href'])
     agency = ''
+    reports = []
     for result in doc.findAll('p'):
       if result.font and result.font.get('color') == "#993333":
         # this is an agency name
@@ -161,7 +162,13 @@ def run(options):
         # this is a report from that agency
         report = report_from(result, category_name, agency, year_range)
         if report:
-          inspector.save_report(report)
+          reports.append(report)
+
+    # reports are saved under many other IGs, so index what's already on disk
+    # for the ones in range on this page at once, rather than one by one
+    inspector.preload_report_ids(report['inspector'] for report in reports)
+    for report in reports:
+      inspector.save_report(report)
 
 
 # extract a dict of details that are ready for inspector.save_report().
@@ -180,6 +187,12 @@ def report_from(result, category_name, agency, year_range):
     return
   report_url = a['href']
 
+  # the listings go back to 1930, so check the date before anything else
+  text = remove_linebreaks(result.text)
+  published_on = published_on_from(text)
+  if not inspector.row_in_range(published_on, year_range, report_url):
+    return
+
   # these will be stored in folders with documents scraped by the official IG scrapers, so
   # use the governmentattic url as slug to assure no conflict.
   report_id = inspector.slugify(report_url.replace('http://www.', ''))
@@ -187,34 +200,14 @@ def report_from(result, category_name, agency, year_range):
   title = remove_linebreaks(a.text).strip()
   if not title:
     return
-  text = remove_linebreaks(result.text)
-  datematch = DATE_RE.search(text)
-  published_on = None
-  datestring = None
   if report_id == "governmentattic.org-21docs-ComplaintsRcvdCFTC_CY2013-2014.pdf":
     if title == "Commodity Futures Trading Commission (CFTC)":
       # Copy-paste error, skip
       return
-  if datematch:
-    datestring = '-'.join(datematch.groups())  # '01-Mar-2015
-    datestring = datestring.replace("-Sept-", "-Sep-")
-    try:
-      published_on = datetime.datetime.strptime(datestring, '%d-%b-%Y')
-    except:
-      published_on = None
-    if not published_on:
-      try:
-        published_on = datetime.datetime.strptime(datestring, '%d-%B-%Y')
-      except:
-        published_on = None
   if not published_on:
     admin.log_no_date("governmentattic", report_id, title, report_url)
     return
 
-  if published_on.year not in year_range:
-    logging.debug("[%s] Skipping, not in requested range." % report_url)
-    return
-
   # ignore documents that are interesting FOIAs but are not IG reports.
   # if you want to scrape IG and agency documents, set IG_REPORTS_ONLY=False
   if IG_REPORTS_ONLY and 'OIG' not in title and 'inspector general' not in title.lower():
@@ -235,4 +228,20 @@ def report_from(result, category_name, agency, year_range):
 
   return report
 
+
+def published_on_from(text):
+  datematch = DATE_RE.search(text)
+  if not datematch:
+    return None
+  datestring = '-'.join(datematch.groups())  # '01-Mar-2015
+  datestring = datestring.replace("-Sept-", "-Sep-")
+  try:
+    return datetime.datetime.strptime(datestring, '%d-%b-%Y')
+  except ValueError:
+    pass
+  try:
+    return datetime.datetime.strptime(datestring, '%d-%B-%Y')
+  except ValueError:
+    return None
+
 utils.run(run) if (__name__ == "__main__") else None
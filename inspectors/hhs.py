@@ -278,17 +278,35 @@ def run(options):
     topics = list(TOPIC_TO_URL.keys())
     topics.sort()
 
-  for topic in topics:
-    extract_reports_for_topic(topic, year_range)
-    if topic in TOPIC_TO_ARCHIVE_URL:
-      extract_reports_for_topic(topic, year_range, archives=True)
+  # Reports are listed under several topics, and are saved once, with all of
+  # their topics, after the crawl. Their URLs don't change between sightings,
+  # so downloads can start right away.
+  # --resume picks up from the topic the last run was crawling.
+  checkpoint = inspector.checkpoint(options)
+  reports = inspector.ReportBuffer(deduplication_key, merge_reports,
+                                   prefetch=lambda report: True,
+                                   checkpoint=checkpoint)
+  if checkpoint.get("stage") != "saving":
+    steps = []
+    for topic in topics:
+      steps.append((topic, False))
+      if topic in TOPIC_TO_ARCHIVE_URL:
+        steps.append((topic, True))
+
+    for step, (topic, archives) in enumerate(steps):
+      if step < checkpoint.get("step", 0):
+        continue
+      reports.checkpoint(step=step)
+      extract_reports_for_topic(topic, year_range, reports, archives=archives)
+    reports.checkpoint(stage="saving")
 
-  deduplicate_finalize()
+  reports.finish()
+  checkpoint.done()
 
 
-def extract_reports_for_topic(topic, year_range, archives=False):
+def extract_reports_for_topic(topic, year_range, reports, archives=False):
   if topic == "OE":
-    extract_reports_for_oei(year_range)
+    extract_reports_for_oei(year_range, reports)
     return
 
   topic_url = TOPIC_TO_ARCHIVE_URL[topic] if archives else TOPIC_TO_URL[topic]
@@ -301,10 +319,10 @@ def extract_reports_for_topic(topic, year_range, archives=False):
   topic_name = TOPIC_NAMES[topic]
   for subtopic_name, subtopic_url in subtopic_map.items():
     logging.debug("## Processing subtopic %s" % subtopic_name)
-    extract_reports_for_subtopic(subtopic_url, year_range, topic_name, subtopic_name)
+    extract_reports_for_subtopic(subtopic_url, year_range, topic_name, subtopic_name, reports)
 
 
-def extract_reports_for_subtopic(subtopic_url, year_range, topic_name, subtopic_name):
+def extract_reports_for_subtopic(subtopic_url, year_range, topic_name, subtopic_name, reports):
   doc = utils.beautifulsoup_from_url(subtopic_url)
   if not doc:
     raise Exception("Failure fetching subtopic URL: %s" % subtopic_url)
@@ -322,17 +340,20 @@ def extract_reports_for_subtopic(subtopic_url, year_range, topic_name, subtopic_
     results = doc.select("#leftContentInterior > p > a")
   if not results:
     raise inspector.NoReportsFoundError("HHS (%s)" % subtopic_name)
-  for result in results:
-    if 'crossref' in result.parent.parent.attrs.get('class', []):
-      continue
-    if result.parent.parent.attrs.get('id') == 'related':
-      continue
-    report = report_from(result, year_range, topic_name, subtopic_url, subtopic_name)
+  results = [result for result in results
+             if 'crossref' not in result.parent.parent.attrs.get('class', []) and
+             result.parent.parent.attrs.get('id') != 'related']
+
+  # reports may need their landing page or a HEAD request for their date,
+  # make those side by side
+  resolved = inspector.resolve_landing_pages(
+    results, lambda result: report_from(result, year_range, topic_name, subtopic_url, subtopic_name))
+  for report in resolved:
     if report:
-      deduplicate_save_report(report)
+      reports.add(report)
 
 
-def extract_reports_for_oei(year_range):
+def extract_reports_for_oei(year_range, reports):
   topic_name = TOPIC_NAMES["OE"]
   topic_url = TOPIC_TO_URL["OE"]
   root_doc = utils.beautifulsoup_from_url(topic_url)
@@ -407,10 +428,12 @@ def extract_reports_for_oei(year_range):
           all_results_links[url][1] = "%s, %s" % (all_results_links[url][1], subtopic_name)
 
   subtopic_url = TOPIC_TO_URL["OE"]
-  for result, subtopic_name in itertools.chain(all_results_links.values(), all_results_unreleased):
-    report = report_from(result, year_range, topic_name, subtopic_url, subtopic_name)
+  rows = itertools.chain(all_results_links.values(), all_results_unreleased)
+  resolved = inspector.resolve_landing_pages(
+    rows, lambda row: report_from(row[0], year_range, topic_name, subtopic_url, row[1]))
+  for report in resolved:
     if report:
-      deduplicate_save_report(report)
+      reports.add(report)
 
 
 def report_from(result, year_range, topic, subtopic_url, subtopic=None):
@@ -650,10 +673,8 @@ def published_on_from_inline_link(result, report_filename, title, report_id, rep
       pass
   if not published_on:
     # Try using the last-modified header
-    response = utils.scraper.request(method='HEAD', url=report_url)
-    last_modified = response.headers['Last-Modified']
-    published_on = datetime.datetime.strptime(last_modified, '%a, %d %b %Y %H:%M:%S %Z')
-    if published_on.year < 2003:
+    published_on = utils.last_modified([report_url])[report_url]
+    if published_on and published_on.year < 2003:
       # We don't trust the last-modified for dates before 2003
       # since a lot of historical reports were published at this
       # time. For these reports, fallback to a hacky method based
@@ -694,31 +715,22 @@ def strip_url_fragment(url):
   scheme, netloc, path, params, query, fragment = urlparse(url)
   return urlunparse((scheme, netloc, path, params, query, ""))
 
-_report_storage = {}
-
-
-def deduplicate_save_report(report):
-  global _report_storage
-  key = (report['title'], report['url'], report['published_on'])
-  if key in _report_storage:
-    if report['topic'] not in _report_storage[key]['topic']:
-      _report_storage[key]['topic'] = _report_storage[key]['topic'] + ", " + \
-          report['topic']
-    if report.get('subtopic'):
-      if _report_storage[key].get('subtopic'):
-        if report['subtopic'] not in _report_storage[key]['subtopic']:
-          _report_storage[key]['subtopic'] = _report_storage[key]['subtopic'] \
-              + ", " + report['subtopic']
-      else:
-        _report_storage[key]['subtopic'] = report['subtopic']
-  else:
-    _report_storage[key] = report
-
-
-def deduplicate_finalize():
-  global _report_storage
-  for report in _report_storage.values():
-    inspector.save_report(report)
-  _report_storage = {}
+def deduplication_key(report):
+  return (report['title'], report['url'], report['published_on'])
+
+
+# either report may already have been merged with others, and list several
+# topics and subtopics
+def merge_reports(existing, report):
+  for topic in report['topic'].split(", "):
+    if topic not in existing['topic']:
+      existing['topic'] = existing['topic'] + ", " + topic
+  if report.get('subtopic'):
+    if existing.get('subtopic'):
+      for subtopic in report['subtopic'].split(", "):
+        if subtopic not in existing['subtopic']:
+          existing['subtopic'] = existing['subtopic'] + ", " + subtopic
+    else:
+      existing['subtopic'] = report['subtopic']
 
 utils.run(run) if (__name__ == "__main__") else None
@@ -47,13 +47,6 @@ DUPLICATE_LANDING_URLS = (
   "https://www.sba.gov/content/audit-report-0-02-audit-sba%E2%80%99s-fy-1998-financial-statements-management-letter-0",
 )
 
-# The report list is not stable, so sometimes we need to fetch the same page of
-# results multiple times to get everything. This constant is the maximum
-# number of times we will do so.
-MAX_RETRIES = 10
-REPORTS_PER_PAGE = 10
-
-
 def run(options):
   year_range = inspector.year_range(options, archive)
 
@@ -62,47 +55,35 @@ def run(options):
   if 'pages' in options:
     pages = min(pages, int(options['pages']))
 
-  rows_seen = set()
-  last_row_count = 0
-
-  for page in reversed(range(pages)):
-    for retry in range(MAX_RETRIES):
-      logging.warning('Fetching page %d, attempt %d' % (page, retry))
-      doc = beautifulsoup_from_page_index(page)
-
-      results = doc.select("tr")
-      if not results:
-        raise inspector.NoReportsFoundError("Small Business Admininstration")
-
-      for index, result in enumerate(results):
-        if not index:
-          # Skip the header row
-          continue
-
-        row_key = (str(result.text), result.a['href'])
-        if row_key not in rows_seen:
-          report = report_from(result, year_range)
-          if report:
-            inspector.save_report(report)
-          rows_seen.add(row_key)
-
-      if page == last_page_index:
-        # Since we're scraping the last page first, always fetch it only once.
-        # If we lose a report between the last page and the second to last page,
-        # we will see nine new reports on the second to last page, and then
-        # retry that one until we get the tenth.
-        break
-      elif len(rows_seen) == last_row_count + REPORTS_PER_PAGE:
-        # We saw as many new reports as we expected to, so we haven't missed
-        # any, and it's safe to move on to the next page
-        break
-      elif len(rows_seen) < last_row_count + REPORTS_PER_PAGE:
-        # We were expecting more new reports on this page, try again
-        continue
-      else:
-        raise AssertionError("Found %d new reports on page %d, too many!" %
-                             (len(rows_seen) - last_row_count, page))
-    last_row_count = len(rows_seen)
+  # The report list is not stable, so sometimes we need to fetch the same page
+  # of results multiple times to get everything. Each publication date is a
+  # slot to fill, see inspector.UnstableListing.
+  listing = inspector.UnstableListing(fetch_page, row_key, get_timestamp)
+  for page, results in listing.new_rows(reversed(range(pages))):
+    for result in results:
+      report = report_from(result, year_range)
+      if report:
+        inspector.save_report(report)
+
+
+def fetch_page(page, attempt):
+  logging.warning('Fetching page %d, attempt %d' % (page, attempt))
+  doc = beautifulsoup_from_page_index(page)
+
+  results = doc.select("tr")
+  if not results:
+    raise inspector.NoReportsFoundError("Small Business Admininstration")
+
+  # Skip the header row
+  return results[1:]
+
+
+def row_key(result):
+  return (str(result.text), result.a['href'])
+
+
+def get_timestamp(result):
+  return result.select("td")[0].text.strip()
 
 
 def beautifulsoup_from_page_index(page):
@@ -114,14 +95,27 @@ def beautifulsoup_from_page_index(page):
 
   headers = {"Content-Type": "application/x-www-form-urlencoded"}
 
-  response = utils.post(REPORTS_AJAX_URL, data=data, headers=headers)
-  if not response:
+  page_html = utils.retry(
+    lambda: page_html_from(utils.post(REPORTS_AJAX_URL, data=data, headers=headers)),
+    description="%s, page %d" % (REPORTS_AJAX_URL, page))
+  if not page_html:
     raise Exception("Failed to fetch data from sba.gov.")
 
-  page_html = response.json()[1]['data']
   return BeautifulSoup(page_html, "lxml")
 
 
+# The listing comes back as a list of AJAX commands, the second of which has
+# the HTML. Returns None for a failed request or an unexpected response, so
+# that they are retried.
+def page_html_from(response):
+  if not response:
+    return None
+  try:
+    return response.json()[1]['data'] or None
+  except (ValueError, IndexError, KeyError, TypeError):
+    return None
+
+
 def get_last_page_index():
   doc = beautifulsoup_from_page_index(0)
   last_page_link = doc.find("a", title="Go to last page")
@@ -263,6 +263,15 @@ def report_from(result, year_range):
 
   summary = None
   if not report_url.endswith(".pdf"):
+    # Check the date given in the link text, if any, before fetching the page.
+    # The report ID, and so any date for it in REPORT_PUBLISHED_MAP, is only
+    # known from the page, so this is only done when no date in the map is in
+    # range, and the link text's date can't be overridden into range.
+    if not mapped_date_in_range(year_range):
+      published_on, _ = published_on_from(None, result)
+      if not inspector.row_in_range(published_on, year_range, report_url):
+        return None
+
     # Some reports link to other page which link to the full report
     report_page = utils.beautifulsoup_from_url(report_url)
     relative_report_url = report_page.select("div.block a[href]")[0]['href']
@@ -285,25 +294,7 @@ def report_from(result, year_range):
   if not title:
     return None
 
-  estimated_date = False
-  published_on = None
-  if report_id in REPORT_PUBLISHED_MAP:
-    published_on = REPORT_PUBLISHED_MAP[report_id]
-
-  if not published_on:
-    try:
-      published_on_text = "/".join(re.search('(\w+) (\d+), (\d+)', title).groups())
-      published_on = datetime.datetime.strptime(published_on_text, '%B/%d/%Y')
-    except AttributeError:
-      pass
-
-  if not published_on:
-    month_year_match = MONTH_YEAR_RE.search(result.text)
-    if month_year_match:
-      date_text = ' '.join(month_year_match.group(0).split())
-      published_on = datetime.datetime.strptime(date_text, '%B %Y')
-      estimated_date = True
-
+  published_on, estimated_date = published_on_from(report_id, result)
   if not published_on:
     admin.log_no_date("smithsonian", report_id, title, report_url)
     return
@@ -329,6 +320,30 @@ def report_from(result, year_range):
     report['estimated_date'] = estimated_date
   return report
 
+
+def mapped_date_in_range(year_range):
+  return any(published_on.year in year_range for published_on in REPORT_PUBLISHED_MAP.values())
+
+# returns (published_on, whether it's estimated), from REPORT_PUBLISHED_MAP if
+# the report ID is known, or else from the link's text
+def published_on_from(report_id, result):
+  if report_id in REPORT_PUBLISHED_MAP:
+    return REPORT_PUBLISHED_MAP[report_id], False
+
+  title = result.text.strip()
+  try:
+    published_on_text = "/".join(re.search('(\w+) (\d+), (\d+)', title).groups())
+    return datetime.datetime.strptime(published_on_text, '%B/%d/%Y'), False
+  except AttributeError:
+    pass
+
+  month_year_match = MONTH_YEAR_RE.search(result.text)
+  if month_year_match:
+    date_text = ' '.join(month_year_match.group(0).split())
+    return datetime.datetime.strptime(date_text, '%B %Y'), True
+
+  return None, False
+
 MONTH_YEAR_RE = re.compile('(?:January|February|March|April|May|June|July|'
                            'August|September|October|November|December)\s+'
                            '[0-9]{4}')
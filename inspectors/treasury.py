@@ -177,6 +177,10 @@ def audit_report_from(result, page_url, year_range):
     except ValueError:
       pass
 
+  # each fiscal year's page also lists some reports from the year before
+  if not inspector.row_in_range(published_on, year_range, published_on_text):
+    return
+
   report_summary = clean_text(children[2].text)
   if not report_summary:
     # There is an extra row that we want to skip
@@ -271,10 +275,6 @@ def audit_report_from(result, page_url, year_range):
   if report_url == "https://www.treasury.gov/about/organizational-structure/ig/Documents/OIG-11-071.pdf":
     report_url = "https://www.treasury.gov/about/organizational-structure/ig/Documents/OIG11071.pdf"
 
-  if published_on.year not in year_range:
-    logging.debug("[%s] Skipping, not in requested range." % report_url)
-    return
-
   report = {
     'inspector': 'treasury',
     'inspector_url': 'https://www.treasury.gov/about/organizational-structure/ig/',
@@ -366,6 +366,9 @@ def report_from(result, page_url, report_type, year_range):
 def semiannual_report_from(result, page_url, year_range):
   published_on_text = clean_text(result.text)
   published_on = datetime.datetime.strptime(published_on_text.strip(), '%B %d, %Y')
+  if not inspector.row_in_range(published_on, year_range, published_on_text):
+    return
+
   title = "Semiannual Report - {}".format(published_on_text)
 
   report_url = urljoin(page_url, result['href'])
@@ -377,10 +380,6 @@ def semiannual_report_from(result, page_url, year_range):
   report_id, extension = os.path.splitext(report_filename)
   report_id = unquote(report_id)
 
-  if published_on.year not in year_range:
-    logging.debug("[%s] Skipping, not in requested range." % report_url)
-    return
-
   report = {
     'inspector': 'treasury',
     'inspector_url': 'https://www.treasury.gov/about/organizational-structure/ig/',
@@ -3,6 +3,7 @@
 from utils import utils, inspector
 from datetime import datetime
 from urllib.parse import urljoin
+import itertools
 import logging
 import os.path
 import re
@@ -24,11 +25,16 @@ archive = 1997
 #             other - Other
 
 # The report list is not stable, so sometimes we need to fetch the same page of
-# results multiple times to get everything. This constant is the maximum number
-# of times we will do so.
-MAX_RETRIES = 10
+# results multiple times to get everything, see inspector.UnstableListing.
 REPORTS_PER_PAGE = 10
 
+# Cache busters added to listing URLs. A page's first request uses the run's,
+# so that the first page fetched by get_last_page() is reused by run(). Every
+# other request for it, i.e. each retry, gets one of its own, so that a copy a
+# CDN cached while it was broken isn't served again.
+RUN_STARTED = int(time.time())
+retry_busters = itertools.count(1)
+
 
 def run(options):
   report_types = options.get('types')
@@ -39,90 +45,79 @@ def run(options):
   for category_name, category_id in categories:
     pages = get_last_page(options, category_id)
 
-    rows_seen = set()
-    pages_to_fetch = range(1, pages + 1)
+    def fetch_page(page, attempt):
+      logging.debug("## Downloading %s, page %i, attempt %i" %
+                    (category_name, page, attempt))
+      doc = fetch_listing_page(options, page, category_id, attempt)
+      if not (doc and listing_is_valid(doc)):
+        # A page with neither reports nor a "no results" message, even after
+        # retrying: there's probably something wrong with the scraper.
+        raise inspector.NoReportsFoundError("USPS %s" % category_name)
+      # skip the header row
+      return [result for result in doc.select("tr") if result.find("td")]
 
     # While the reports themselves may shuffle around, the order of the dates
     # of the reports and how many of each date we see on each page will stay
-    # constant. This dictionary will hold how many times we see each date.
-    # We can stop retrying pages once we have as many unique reports for each
-    # date as there are slots for that date.
-    date_slot_counts = {}
-
-    # This keeps track of how many unique reports we have found on each date,
-    # for comparison with the numbers above.
-    date_unique_report_counts = {}
-
-    # This dict maps from a report date to a list of pages on which that date
-    # was seen.
-    date_to_pages = {}
-
-    for retry in range(MAX_RETRIES):
-      for page in pages_to_fetch:
-        logging.debug("## Downloading %s, page %i, attempt %i" %
-                      (category_name, page, retry))
-        url = url_for(options, page, category_id)
-        doc = utils.beautifulsoup_from_url(url)
-
-        results = doc.select("tr")
-        if not results:
-          if ("Still can't find what you are searching for?" in
-                  doc.select(".content")[0].text):
-            # this search returned 0 results.
-            pass
-          else:
-            # Otherwise, there's probably something wrong with the scraper.
-            raise inspector.NoReportsFoundError("USPS %s" % category_name)
-        for result in results:
-          if not result.find("td"):
-            # Header row
-            continue
-          if retry == 0:
-            timestamp = get_timestamp(result)
-            if timestamp in date_slot_counts:
-              date_slot_counts[timestamp] = date_slot_counts[timestamp] + 1
-            else:
-              date_slot_counts[timestamp] = 1
-              date_unique_report_counts[timestamp] = 0
-
-            if timestamp in date_to_pages:
-              if page not in date_to_pages[timestamp]:
-                date_to_pages[timestamp].append(page)
-            else:
-              date_to_pages[timestamp] = [page]
-
-          row_key = (str(result.text), result.a['href'])
-          if row_key not in rows_seen:
-            rows_seen.add(row_key)
-            timestamp = get_timestamp(result)
-            date_unique_report_counts[timestamp] = \
-                date_unique_report_counts[timestamp] + 1
-
-            report = report_from(result)
-            inspector.save_report(report)
-
-      pages_to_fetch = set()
-      for date, report_count in date_unique_report_counts.items():
-        if report_count < date_slot_counts[date]:
-          for page in date_to_pages[date]:
-            pages_to_fetch.add(page)
-      if len(pages_to_fetch) == 0:
-        break
-      pages_to_fetch = list(pages_to_fetch)
-      pages_to_fetch.sort()
+    # constant, so each date is a slot to fill.
+    listing = inspector.UnstableListing(fetch_page, row_key, get_timestamp)
+    for page, results in listing.new_rows(range(1, pages + 1)):
+      for report in inspector.resolve_landing_pages(results, report_from,
+                                                    landing_url_for):
+        inspector.save_report(report)
 
 
 def get_last_page(options, category_id):
-  url = url_for(options, 1, category_id)
-  doc = utils.beautifulsoup_from_url(url)
+  doc = fetch_listing_page(options, 1, category_id, 0)
   return last_page_for(doc)
 
 
+# attempt: how many times the page has been fetched before, see
+# inspector.UnstableListing. Broken copies are retried, see listing_is_valid.
+def fetch_listing_page(options, page, category_id, attempt):
+  url = url_for(options, page, category_id)
+  requests = itertools.count()
+  def fetch():
+    if (attempt == 0) and (next(requests) == 0):
+      cache_buster = "%i" % RUN_STARTED
+    else:
+      cache_buster = "%i-%i" % (RUN_STARTED, next(retry_busters))
+    return fetch_listing("%s&t=%s" % (url, cache_buster))
+  return utils.retry(fetch, listing_is_valid, description=url)
+
+
+# Listing pages are reused between get_last_page() and run(), but a broken
+# copy shouldn't be, so it's dropped before the page is retried.
+def fetch_listing(url):
+  doc = utils.beautifulsoup_from_url(url, shared_tree=True)
+  if doc and not listing_is_valid(doc):
+    utils.page_memo.forget(url)
+  return doc
+
+
+# A listing page should have either reports, or a message saying that the
+# search returned 0 results.
+def listing_is_valid(doc):
+  if doc.select("tr"):
+    return True
+  content = doc.select(".content")
+  return bool(content) and \
+      ("Still can't find what you are searching for?" in content[0].text)
+
+
+def row_key(result):
+  return (str(result.text), result.a['href'])
+
+
 def get_timestamp(result):
   cells = result.select("td")
   return cells[0].text.strip()
 
 
+def landing_url_for(result):
+  cells = result.select("td")
+  return urljoin("https://uspsoig.gov/", cells[1].a["href"])
+
+
 # extract fields from HTML, return dict
 def report_from(result):
   report = {
@@ -142,8 +137,7 @@ def report_from(result):
 
   # if there's only one button, use that URL
   # otherwise, look for "Read Full Report" (could be first or last)
-  link = cells[1].a
-  landing_url = urljoin("https://uspsoig.gov/", link["href"])
+  landing_url = landing_url_for(result)
   report['landing_url'] = landing_url
 
   landing_page = utils.beautifulsoup_from_url(landing_url)
@@ -223,9 +217,6 @@ def url_for(options, page, category_id):
   if page > 1:
     url += "&page=%i" % (page - 1)
 
-  # Add a cache buster, this helps once we start retrying pages
-  url += "&t=%i" % int(time.time())
-
   return url
 
 
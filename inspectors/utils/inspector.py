@@ -5,6 +5,12 @@ import logging
 import datetime
 import urllib.parse
 import inspect
+import threading
+import json
+import sqlite3
+import tempfile
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
 from . import admin
 # Save a report to disk, provide output along the way.
@@ -16,12 +22,20 @@ from . import admin
 # fields used: file_type, url, inspector, year, report_id
 # fields added: report_path, text_path
 
-def save_report(report):
-  caller_filename = inspect.stack()[1][1]
-  caller_scraper = os.path.splitext(os.path.basename(caller_filename))[0]
+def save_report(report, caller_scraper=None):
+  if caller_scraper is None:
+    caller_filename = inspect.stack()[1][1]
+    caller_scraper = os.path.splitext(os.path.basename(caller_filename))[0]
 
   options = utils.options()
 
+  checkpoint = Checkpoint.active.get(caller_scraper)
+  # computed before preprocess_report() changes any fields
+  saved_key = checkpoint.key_for(report) if checkpoint else None
+  if checkpoint and checkpoint.was_saved(saved_key):
+    logging.warn("[%s] Already saved before resuming, skipping" % report.get('report_id'))
+    return True
+
   # create some inferred fields, set defaults
   preprocess_report(report)
 
@@ -63,9 +77,313 @@ def save_report(report):
   logging.warn("\tdata: %s" % data_path)
 
   admin.log_report(caller_scraper)
+  if checkpoint:
+    checkpoint.report_saved(saved_key)
   return True
 
 
+# A long crawl (e.g. gaoreports --since=1970, or hhs --archive) that dies
+# partway through would otherwise have to walk every listing page again on
+# the next run. A scraper records how far through its listings it has got
+# with checkpoint.save(), e.g. save(year=2004, offset=150) before it starts
+# on that page, and save_report() records each report saved after that.
+#
+# With --resume, checkpoint.get() returns the position the last run reached
+# (as long as it was run with the same options), and save_report() skips the
+# reports it already saved there. done() removes the checkpoint once the
+# crawl is complete, and a run without --resume removes any left over from
+# an earlier run. Checkpoints are kept in the data directory, as
+# .checkpoint.<scraper>.json, with the saved reports in
+# .checkpoint.<scraper>.saved (.checkpoint.<scraper>.<year>.* for a --year
+# run).
+#
+# Saved reports are told apart by key_for(report), the report_id unless the
+# scraper identifies its reports some other way; a ReportBuffer given a
+# checkpoint uses its own key_for.
+CHECKPOINT_OPTIONS = ("since", "year", "archive", "component", "topics", "types", "pages")
+
+class Checkpoint(object):
+  # scraper -> its Checkpoint, for save_report()
+  active = {}
+
+  def __init__(self, scraper, options, key_for=None):
+    self.scraper = scraper
+    self.key_for = key_for or (lambda report: report.get('report_id'))
+    self.options = {}
+    for name in CHECKPOINT_OPTIONS:
+      if options.get(name) is not None:
+        self.options[name] = options.get(name)
+
+    self.cursor = {}
+    self.resumed_reports = set()
+    if options.get('resume'):
+      self.load()
+    else:
+      for ext in ("json", "sqlite"):
+        utils.remove_if_exists(self.path_for(ext))
+    utils.mkdir_p(utils.data_dir())
+    self.saved_file = open(self.path_for("saved"), "a" if self.cursor else "w", encoding="utf-8")
+    Checkpoint.active[scraper] = self
+
+  # runs for different years of one IG (see igs --shard) can go at once, so
+  # each year has its own checkpoint
+  def path_for(self, ext):
+    name = self.scraper
+    if self.options.get("year"):
+      name = "%s.%s" % (name, self.options["year"])
+    return os.path.join(utils.data_dir(), ".checkpoint.%s.%s" % (name, ext))
+
+  def load(self):
+    if not os.path.exists(self.path_for("json")):
+      logging.warn("[%s] No checkpoint to resume from, starting over" % self.scraper)
+      return
+
+    with open(self.path_for("json"), "r", encoding="utf-8") as f:
+      checkpoint = json.load(f)
+    if checkpoint["options"] != self.options:
+      logging.warn("[%s] Checkpoint was made with other options (%s), starting over" %
+                   (self.scraper, checkpoint["options"]))
+      return
+
+    self.cursor = checkpoint["cursor"]
+    if os.path.exists(self.path_for("saved")):
+      with open(self.path_for("saved"), "r", encoding="utf-8") as f:
+        self.resumed_reports = set(self.decode_key(line) for line in f if line.strip())
+    logging.warn("[%s] Resuming from %s, %i reports already saved there" %
+                 (self.scraper, self.cursor, len(self.resumed_reports)))
+
+  def resuming(self):
+    return bool(self.cursor)
+
+  def get(self, name, default=None):
+    return self.cursor.get(name, default)
+
+  def save(self, **cursor):
+    # a resumed run saves the cursor it resumed from again when it gets back
+    # there, and the reports saved there before still count
+    if cursor != self.cursor:
+      self.resumed_reports = set()
+      self.saved_file.seek(0)
+      self.saved_file.truncate()
+      self.saved_file.flush()
+    self.cursor = cursor
+    utils.write(json.dumps({"options": self.options, "cursor": cursor}, sort_keys=True),
+                self.path_for("json"))
+
+  # key: from key_for(report)
+  def was_saved(self, key):
+    return key in self.resumed_reports
+
+  def report_saved(self, key):
+    self.saved_file.write(json.dumps(key) + "\n")
+    self.saved_file.flush()
+
+  # keys are written as JSON, which turns tuples into lists
+  def decode_key(self, line):
+    key = json.loads(line)
+    return tuple(key) if isinstance(key, list) else key
+
+  def done(self):
+    self.saved_file.close()
+    for ext in ("json", "saved"):
+      utils.remove_if_exists(self.path_for(ext))
+    Checkpoint.active.pop(self.scraper, None)
+
+def checkpoint(options, key_for=None):
+  caller_filename = inspect.stack()[1][1]
+  caller_scraper = os.path.splitext(os.path.basename(caller_filename))[0]
+  return Checkpoint(caller_scraper, options, key_for)
+
+
+# Some scrapers see the same report more than once while crawling, e.g. under
+# several topics or components, and merge those sightings into one report
+# before saving it. ReportBuffer does the merging without holding every
+# report until the end of the crawl:
+#
+# - add(report) merges the report into any earlier one with the same
+#   key_for(report), using merge(existing, new). Once more than max_in_memory
+#   reports are held, they are spilled to a temporary SQLite file, and the
+#   spilled pieces of each report are merged back together in finish().
+# - the first time a key is seen, if prefetch(report) is true (i.e. later
+#   sightings can't change which file the report is), its file is downloaded
+#   in the background, so downloads overlap the crawl and save_report() finds
+#   the file already on disk.
+# - finish() saves the merged reports, in the order their keys were first
+#   seen, and returns how many it saved.
+#
+# Given a Checkpoint, the spill file is kept next to it instead, and
+# checkpoint(**cursor) spills everything buffered so far before saving the
+# cursor, so a resumed run picks up the reports merged before it.
+MAX_BUFFERED_REPORTS = 5000
+PREFETCH_WORKERS = 2
+
+class ReportBuffer(object):
+  def __init__(self, key_for, merge, prefetch=None, max_in_memory=MAX_BUFFERED_REPORTS,
+               checkpoint=None):
+    caller_filename = inspect.stack()[1][1]
+    self.caller_scraper = os.path.splitext(os.path.basename(caller_filename))[0]
+
+    self.key_for = key_for
+    self.merge = merge
+    self.prefetch = prefetch
+    self.max_in_memory = max_in_memory
+
+    # key -> [sequence number, report]
+    self.reports = collections.OrderedDict()
+    self.sequence = 0
+    self.spill_file = None
+    self.spill_db = None
+    self.spilled_keys = set()
+
+    self.prefetcher = None
+    self.prefetched_paths = set()
+    # prefetched files that weren't on disk before, see remove_prefetched()
+    self.new_paths = set()
+
+    self.checkpoint_ = checkpoint
+    if checkpoint:
+      checkpoint.key_for = key_for
+      spill_path = checkpoint.path_for("sqlite")
+      if checkpoint.resuming() and os.path.exists(spill_path):
+        self.open_spill_db(spill_path)
+        # drop anything spilled after the checkpoint, it will be seen again
+        self.sequence = checkpoint.get("buffered", 0)
+        self.spill_db.execute("DELETE FROM reports WHERE sequence > ?", (self.sequence,))
+        for (key,) in self.spill_db.execute("SELECT DISTINCT key FROM reports"):
+          key = json.loads(key)
+          self.spilled_keys.add(tuple(key) if isinstance(key, list) else key)
+      else:
+        utils.remove_if_exists(spill_path)
+
+  def add(self, report):
+    key = self.key_for(report)
+    self.sequence += 1
+
+    if key in self.reports:
+      self.merge(self.reports[key][1], report)
+      return
+
+    if key not in self.spilled_keys:
+      self.start_prefetch(report)
+    self.reports[key] = [self.sequence, report]
+    if len(self.reports) > self.max_in_memory:
+      self.spill()
+
+  # Only reports that pass the checks save_report() makes are prefetched, so
+  # that a report it rejects doesn't leave a file behind; those are left to
+  # save_report() to deal with.
+  def start_prefetch(self, report):
+    options = utils.options()
+    if (not self.prefetch) or options.get('dry_run') or report.get('unreleased') or \
+        (not report.get('url')) or (not self.prefetch(report)):
+      return
+    if self.checkpoint_ and self.checkpoint_.was_saved(self.checkpoint_.key_for(report)):
+      return
+
+    # work on a copy, the report may still be merged with later sightings
+    report = dict(report)
+    preprocess_report(report)
+    if not (report.get('file_type') and report.get('year')):
+      return
+    if validate_report(report) != True:
+      return
+    if ReportIdCache.get_cache().is_duplicate(report['inspector'], report['report_id'],
+                                              report['year'], self.caller_scraper):
+      return
+    report_path = path_for(report, report['file_type'])
+    if report_path in self.prefetched_paths:
+      return
+    self.prefetched_paths.add(report_path)
+    if not os.path.exists(os.path.join(utils.data_dir(), report_path)):
+      self.new_paths.add(report_path)
+
+    if self.prefetcher is None:
+      self.prefetcher = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS)
+    self.prefetcher.submit(download_report, report, self.caller_scraper)
+
+  # removes the file prefetched for a report that then failed to save
+  def remove_prefetched(self, report):
+    if not (report.get('file_type') and report.get('year') and report.get('report_id')):
+      return
+    report_path = path_for(report, report['file_type'])
+    if report_path in self.new_paths:
+      utils.remove_if_exists(os.path.join(utils.data_dir(), report_path))
+
+  def open_spill_db(self, path):
+    self.spill_db = sqlite3.connect(path)
+    self.spill_db.execute("CREATE TABLE IF NOT EXISTS reports (key TEXT, sequence INTEGER, report TEXT)")
+    self.spill_db.execute("CREATE INDEX IF NOT EXISTS reports_key ON reports (key)")
+
+  def spill(self):
+    if self.spill_db is None:
+      if self.checkpoint_:
+        self.open_spill_db(self.checkpoint_.path_for("sqlite"))
+      else:
+        self.spill_file = tempfile.NamedTemporaryFile(suffix=".sqlite")
+        self.open_spill_db(self.spill_file.name)
+
+    rows = []
+    for key, (sequence, report) in self.reports.items():
+      rows.append((json.dumps(key), sequence, json.dumps(report)))
+      self.spilled_keys.add(key)
+    self.spill_db.executemany("INSERT INTO reports VALUES (?, ?, ?)", rows)
+    self.spill_db.commit()
+    self.reports.clear()
+
+  def checkpoint(self, **cursor):
+    self.spill()
+    self.checkpoint_.save(buffered=self.sequence, **cursor)
+
+  def merged_reports(self):
+    if self.spill_db is None:
+      for sequence, report in self.reports.values():
+        yield report
+      return
+
+    self.spill()
+    rows = self.spill_db.execute(
+      "SELECT reports.key, reports.report FROM reports JOIN "
+      "(SELECT key, MIN(sequence) AS first FROM reports GROUP BY key) AS firsts "
+      "ON reports.key = firsts.key ORDER BY firsts.first, reports.sequence")
+    current_key, current = None, None
+    for key, report in rows:
+      report = json.loads(report)
+      if key == current_key:
+        self.merge(current, report)
+      else:
+        if current is not None:
+          yield current
+        current_key, current = key, report
+    if current is not None:
+      yield current
+
+  def finish(self):
+    if self.prefetcher is not None:
+      self.prefetcher.shutdown(wait=True)
+      self.prefetcher = None
+
+    count = 0
+    for report in self.merged_reports():
+      try:
+        save_report(report, caller_scraper=self.caller_scraper)
+      except Exception:
+        self.remove_prefetched(report)
+        raise
+      count += 1
+
+    # a checkpointed spill file is only removed once everything is saved
+    if self.spill_db is not None:
+      self.spill_db.close()
+      if self.spill_file:
+        self.spill_file.close()
+      else:
+        utils.remove_if_exists(self.checkpoint_.path_for("sqlite"))
+      self.spill_db, self.spill_file = None, None
+    self.reports.clear()
+    self.spilled_keys.clear()
+    return count
+
+
 # Preprocess before validation, to catch cases where inference didn't work.
 # So, fields may be absent at this time.
 def preprocess_report(report):
@@ -211,33 +529,50 @@ class ReportIdCache:
       self.singleton = ReportIdCache()
     return self.singleton
 
+  # forget everything, e.g. between the separate runs of one igs process
+  @classmethod
+  def reset(self):
+    self.singleton = None
+
   def __init__(self):
     self.disk = {}
     self.runtime = {}
 
   def scan_disk(self, inspector, scraper):
-    self.disk[inspector] = {}
-    data_dir = utils.data_dir()
-    inspector_path = os.path.join(data_dir, inspector)
-    if os.path.isdir(inspector_path):
-      for year_folder in os.listdir(inspector_path):
-        year_disk = int(year_folder)
-        year_path = os.path.join(inspector_path, year_folder)
-        if os.path.isdir(year_path):
-          for report_id_disk in os.listdir(year_path):
-            report_path = os.path.join(year_path, report_id_disk)
-            report_id_disk = CaseInsensitiveString(report_id_disk)
-            if os.path.isdir(report_path):
-              if report_id_disk in self.disk[inspector]:
-                year_last = self.disk[inspector][report_id_disk]
-                msg = "[%s] Duplicate report_id: %s is saved under %d and %d" %\
-                        (inspector,
-                        report_id_disk,
-                        year_last,
-                        year_disk)
-                print(msg)
-                admin.log_duplicate_id(inspector, report_id_disk, msg)
-              self.disk[inspector][report_id_disk] = year_disk
+    self.preload([inspector])
+
+  # Scans several inspectors' directories at once, for scrapers that save
+  # reports under many other inspectors, instead of one by one as their
+  # first reports come up.
+  def preload(self, inspectors):
+    pending = sorted(set(inspector for inspector in inspectors
+                         if inspector not in self.disk))
+    if not pending:
+      return
+    scans = scan_inspector_dirs(pending, workers=SCAN_WORKERS)
+    for inspector in pending:
+      self.record_scan(inspector, *scans[inspector])
+
+  def record_scan(self, inspector, index, duplicates):
+    for report_id_disk, year_last, year_disk in duplicates:
+      msg = "[%s] Duplicate report_id: %s is saved under %d and %d" %\
+              (inspector,
+              report_id_disk,
+              year_last,
+              year_disk)
+      print(msg)
+      admin.log_duplicate_id(inspector, report_id_disk, msg)
+    self.disk[inspector] = index
+
+  # whether add() would report this report_id as a duplicate, without
+  # recording it
+  def is_duplicate(self, inspector, report_id, report_year, scraper):
+    report_id = CaseInsensitiveString(report_id)
+    if inspector not in self.disk:
+      self.scan_disk(inspector, scraper)
+    if report_id in self.runtime.get(inspector, ()):
+      return True
+    return (report_id in self.disk[inspector]) and (report_year != self.disk[inspector][report_id])
 
   def add(self, inspector, report_id, report_year, scraper):
     report_id = CaseInsensitiveString(report_id)
@@ -262,6 +597,26 @@ class ReportIdCache:
     self.runtime[inspector].add(report_id)
 
 
+# how many inspectors' directories ReportIdCache.preload() scans at once
+SCAN_WORKERS = 8
+
+# Returns, for each inspector, an index of report_id -> year for the reports
+# saved on disk, and a list of (report_id, year, other year) for any report_id
+# found under more than one year. This only reads the data directory, so
+# several inspectors can be listed at once.
+def scan_inspector_dirs(inspectors, workers=None):
+  scans = dict((inspector, ({}, [])) for inspector in inspectors)
+  reports = utils.iter_reports(utils.data_dir(), inspectors, workers=workers,
+                               list_files=False)
+  for report in reports:
+    index, duplicates = scans[report.inspector]
+    year_disk = int(report.year)
+    report_id_disk = CaseInsensitiveString(report.report_id)
+    if report_id_disk in index:
+      duplicates.append((report_id_disk, index[report_id_disk], year_disk))
+    index[report_id_disk] = year_disk
+  return scans
+
 def check_uniqueness(inspector, report_id, report_year, scraper):
   '''Given the name of an inspector, the ID of a report, and the year of the
   report, this function will check whether a duplicate report_id exists on-disk
@@ -274,6 +629,13 @@ def check_uniqueness(inspector, report_id, report_year, scraper):
   cache.add(inspector, report_id, report_year, scraper)
 
 
+# Scrapers that save reports under many inspectors can call this up front,
+# so that the reports already on disk for all of them are indexed in one
+# concurrent pass, rather than one inspector at a time mid-run.
+def preload_report_ids(inspectors):
+  ReportIdCache.get_cache().preload(inspectors)
+
+
 # run over common string fields automatically
 sanitize_table = str.maketrans({
   "\xa0": " ",          # no-break space
@@ -440,6 +802,134 @@ def year_range(options, archive):
 
   return year_range
 
+# Listings that reach far back cost parsing work, and often a landing page
+# fetch, for every row, even though a run usually only wants this year's.
+# Scrapers can call this as soon as a row's date (or just its year) can be
+# read off the row cheaply, and skip the row before doing anything costly
+# with it. Rows without a date are kept, so the full parse can log them.
+def row_in_range(published_on, year_range, description=None):
+  if published_on is None:
+    return True
+  year = published_on if isinstance(published_on, int) else published_on.year
+  if year in year_range:
+    return True
+  if description:
+    logging.debug("[%s] Skipping, not in requested range." % description)
+  return False
+
+# Many scrapers build each report from a row of a listing page plus that
+# row's landing page, which makes for one slow request per row. This runs
+# report_from(row) for a batch of rows, e.g. one listing page, on several
+# threads at once, with at most per_host requests in flight to any one host.
+# landing_url_for(row) gives the landing page URL of a row, and is only used
+# to pick its host. Results are yielded in the same order as rows, as soon as
+# each one is ready, so reports are saved (and their IDs checked for
+# uniqueness) in the same order as when the rows are processed one by one.
+LANDING_PAGE_WORKERS = 8
+LANDING_PAGES_PER_HOST = 4
+
+def resolve_landing_pages(rows, report_from, landing_url_for=None,
+                          workers=LANDING_PAGE_WORKERS, per_host=LANDING_PAGES_PER_HOST):
+  rows = list(rows)
+  if not rows:
+    return
+
+  host_limits = {}
+  host_limits_lock = threading.Lock()
+
+  def resolve(row):
+    landing_url = landing_url_for(row) if landing_url_for else None
+    host = urllib.parse.urlparse(landing_url).netloc if landing_url else None
+    with host_limits_lock:
+      limit = host_limits.setdefault(host, threading.BoundedSemaphore(per_host))
+    with limit:
+      return report_from(row)
+
+  with ThreadPoolExecutor(max_workers=min(workers, len(rows))) as pool:
+    futures = [pool.submit(resolve, row) for row in rows]
+    try:
+      for future in futures:
+        yield future.result()
+    finally:
+      # if the caller stops early, don't start on rows nobody will see
+      for future in futures:
+        future.cancel()
+
+# Some sites' listings aren't stable: reports shuffle between pages from one
+# request to the next, so a single pass over the pages can miss some reports
+# and see others twice. While the reports move around, the number of reports
+# in each slot (e.g. each publication date) stays the same, so once a slot
+# has as many distinct reports as the first pass showed, none are missing.
+#
+# UnstableListing fetches every page, several at a time, then re-fetches only
+# the pages on which incomplete slots were seen, until every slot is
+# accounted for or it has made max_requests page requests (by default,
+# LISTING_REQUESTS_PER_PAGE for each page).
+#
+# fetch_page(page, attempt) returns the rows on a page, where attempt counts
+# the passes over the listing, row_key(row) tells rows apart, and
+# slot_of(row) gives a row's slot. new_rows(pages) yields (page, rows) with
+# the rows on each page that haven't been seen before, in the order of pages.
+LISTING_REQUESTS_PER_PAGE = 3
+
+class UnstableListing(object):
+  def __init__(self, fetch_page, row_key, slot_of, max_requests=None,
+               workers=utils.FETCH_WORKERS):
+    self.fetch_page = fetch_page
+    self.row_key = row_key
+    self.slot_of = slot_of
+    self.max_requests = max_requests
+    self.workers = workers
+
+  def new_rows(self, pages):
+    pages = list(pages)
+    max_requests = self.max_requests or (LISTING_REQUESTS_PER_PAGE * len(pages))
+
+    # how many rows each slot has, from the first pass
+    slot_counts = {}
+    # how many distinct rows have been seen in each slot
+    slot_unique_counts = {}
+    # the pages on which each slot has been seen
+    slot_pages = {}
+    rows_seen = set()
+
+    requests = 0
+    attempt = 0
+    pages_to_fetch = pages
+    while pages_to_fetch:
+      pages_to_fetch = pages_to_fetch[:max_requests - requests]
+      requests += len(pages_to_fetch)
+      page_rows = utils.map_concurrently(
+        lambda page: self.fetch_page(page, attempt), pages_to_fetch, self.workers)
+
+      for page, rows in zip(pages_to_fetch, page_rows):
+        new_rows = []
+        for row in rows:
+          slot = self.slot_of(row)
+          if attempt == 0:
+            slot_counts[slot] = slot_counts.get(slot, 0) + 1
+          slot_pages.setdefault(slot, set()).add(page)
+
+          key = self.row_key(row)
+          if key not in rows_seen:
+            rows_seen.add(key)
+            slot_unique_counts[slot] = slot_unique_counts.get(slot, 0) + 1
+            new_rows.append(row)
+        yield page, new_rows
+
+      incomplete = [slot for slot, count in slot_counts.items()
+                    if slot_unique_counts.get(slot, 0) < count]
+      refetch = set()
+      for slot in incomplete:
+        refetch.update(slot_pages[slot])
+      pages_to_fetch = [page for page in pages if page in refetch]
+      attempt += 1
+
+      if pages_to_fetch and (requests >= max_requests):
+        logging.warn("Giving up on %i incomplete listing slots after %i page requests" %
+                     (len(incomplete), requests))
+        break
+
 class NoReportsFoundError(AssertionError):
   def __init__(self, value):
     self.value = value
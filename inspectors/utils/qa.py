@@ -0,0 +1,401 @@
+import contextlib
+import hashlib
+import io
+import os
+import pickle
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+from . import utils
+from . import admin
+
+# Runs QA checks over the data directory in a single pass.
+#
+# Each check (a subclass of Check, one per script in scripts/) says which
+# reports and files it wants to look at. The data directory is walked once,
+# reports are handed out in batches to worker processes, and each file is
+# read at most once, in chunks, with every chunk passed to each check that
+# asked for that file. Whatever a check's visitors return comes back to the
+# parent process in the order of the walk, where the check's finish() turns
+# it into output.
+#
+# What each file visitor found is kept in STATE_PATH between runs, keyed by
+# the check and the file's path. A file whose size and modification time are
+# unchanged, or whose content hash is, isn't read or visited again: its
+# stored results are passed to finish() along with the new ones, so checks
+# that compare files with each other (duplicate IDs, near-duplicates) still
+# see the whole archive, while only new and changed files cost anything.
+# Report visitors aren't stored, and should stay cheap.
+#
+# Usage, from a script:
+#
+#   class MyCheck(qa.Check):
+#     def file_visitor(self, report, filename):
+#       if filename == "report.txt":
+#         return MyVisitor(report.path_for(filename))
+#
+#   def run(options):
+#     qa.run_check(MyCheck(), options)
+
+# reports are handed to the worker processes this many at a time
+REPORTS_PER_BATCH = 250
+
+# files are read in chunks of this many bytes
+READ_SIZE = 1024 * 1024
+
+# where the results of earlier runs are kept, outside of the data directory
+STATE_PATH = ".qa_state.sqlite"
+
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+  check_key TEXT NOT NULL,
+  path TEXT NOT NULL,
+  size INTEGER,
+  mtime REAL,
+  hash TEXT,
+  results BLOB,
+  PRIMARY KEY (check_key, path)
+);
+"""
+
+
+class Check(object):
+  """A QA check. Visitors run in worker processes, and return a list of
+  results (or None); start() and finish() run in the parent process, and
+  whatever they print is the check's output."""
+
+  # only check these inspectors, or every inspector if None
+  inspectors = None
+
+  # bump this when the file visitors' results change, so that results stored
+  # by earlier runs aren't used
+  version = 1
+
+  def state_key(self):
+    return "%s/%i" % (type(self).__name__, self.version)
+
+  def start(self, options):
+    pass
+
+  # returns results for a report directory (a utils.ReportDir)
+  def visit_report(self, report):
+    return None
+
+  # returns a FileVisitor for a file in a report directory, if the check
+  # wants to look at it
+  def file_visitor(self, report, filename):
+    return None
+
+  # gets all the results of the visitors, in the order of the walk
+  def finish(self, results):
+    for result in results:
+      print(result)
+
+  def wants(self, report):
+    return (self.inspectors is None) or (report.inspector in self.inspectors)
+
+
+class FileVisitor(object):
+  """Gets a file's contents in chunks, from the single read of the file that
+  all checks share."""
+
+  # read at most this many bytes of the file, or all of it if None, or none
+  # of it if 0 (e.g. for checks that only need the path or stat)
+  max_bytes = None
+
+  def update(self, chunk):
+    pass
+
+  # returns results for the file
+  def result(self):
+    return None
+
+
+# Runs several checks over the reports of the given inspectors (or all of
+# them), and returns each check's output as a string, in the same order.
+def run_checks(checks, options, workers=None, state_path=STATE_PATH):
+  outputs = [io.StringIO() for check in checks]
+  started = []
+  for check, output in zip(checks, outputs):
+    if capture(output, check.start, options):
+      started.append((check, output))
+  if not started:
+    return [output.getvalue() for output in outputs]
+
+  checks = [check for check, _ in started]
+  state = QAState(state_path, [check.state_key() for check in checks]) if state_path else None
+  results = [[] for check in checks]
+  try:
+    for batch_results, batch_errors, updates, seen in check_reports(checks, options, workers, state):
+      for i in range(len(checks)):
+        results[i].extend(batch_results[i])
+        for error in batch_errors[i]:
+          print(error, file=started[i][1])
+      if state:
+        state.update(updates, seen)
+    if state:
+      state.prune()
+  finally:
+    if state:
+      state.close()
+
+  for (check, output), check_results in zip(started, results):
+    capture(output, check.finish, check_results)
+
+  return [output.getvalue() for output in outputs]
+
+# Runs one check, and prints its output. This is what each script's run()
+# does, when it's run on its own.
+def run_check(check, options):
+  output = run_checks([check], options, workers=options.get("workers"))[0]
+  if output:
+    print(output, end="")
+
+
+class QAState(object):
+  """The file visitors' results from earlier runs. Only the parent process
+  writes to it; workers look results up through their own read-only
+  connections. keys are the state keys this connection updates and prunes."""
+
+  def __init__(self, path, keys):
+    self.path = path
+    self.keys = list(keys)
+    self.db = sqlite3.connect(path)
+    self.db.executescript(STATE_SCHEMA)
+    self.db.commit()
+    self.seen = set()
+    self.prefixes = None
+
+  # only results under these directories are pruned, if they weren't seen
+  def walking(self, directories):
+    self.prefixes = tuple(os.path.join(directory, "") for directory in directories)
+
+  # returns (size, mtime, hash, results) for a file, or None
+  def lookup(self, key, path):
+    return self.db.execute("SELECT size, mtime, hash, results FROM results "
+                           "WHERE check_key = ? AND path = ?", (key, path)).fetchone()
+
+  def update(self, updates, seen):
+    self.db.executemany("INSERT OR REPLACE INTO results (check_key, path, size, mtime, hash, results) "
+                        "VALUES (?, ?, ?, ?, ?, ?)", updates)
+    self.db.commit()
+    self.seen.update(seen)
+
+  # forget files that are gone now
+  def prune(self):
+    if self.prefixes is None:
+      return
+    stale = []
+    for check_key, path in self.db.execute("SELECT check_key, path FROM results"):
+      if (check_key in self.keys) and path.startswith(self.prefixes) and \
+          ((check_key, path) not in self.seen):
+        stale.append((check_key, path))
+    self.db.executemany("DELETE FROM results WHERE check_key = ? AND path = ?", stale)
+    self.db.commit()
+
+  def close(self):
+    self.db.close()
+
+# Runs a check's step with its output captured. Returns whether it worked,
+# logging the exception if it didn't, like utils.run() does for scrapers.
+def capture(output, method, *args):
+  try:
+    with contextlib.redirect_stdout(output):
+      method(*args)
+    return True
+  except Exception as exception:
+    admin.log_exception(exception)
+    print("Error: %s" % exception, file=output)
+    return False
+
+# yields (results, errors, updates, seen) for each batch of reports, see
+# check_batch()
+def check_reports(checks, options, workers=None, state=None):
+  data_dir = utils.data_dir()
+  inspectors = options.get("inspectors") or None
+  if all(check.inspectors is not None for check in checks):
+    wanted = set()
+    for check in checks:
+      wanted.update(check.inspectors)
+    inspectors = [inspector for inspector in sorted(wanted)
+                  if (not inspectors) or (inspector in inspectors)]
+    if not inspectors:
+      return
+
+  state_path = None
+  if state:
+    state_path = state.path
+    state.walking([os.path.join(data_dir, inspector)
+                   for inspector in utils.inspector_names(data_dir, inspectors)])
+
+  reports = utils.iter_reports(data_dir, inspectors, list_files=False)
+  batches = batches_of(reports, REPORTS_PER_BATCH)
+
+  workers = int(workers) if workers else os.cpu_count()
+  if workers <= 1:
+    for batch in batches:
+      yield check_batch(checks, batch, state_path)
+    return
+
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    # keep a few batches queued per worker, rather than the whole walk
+    pending = []
+    for batch in batches:
+      pending.append(pool.submit(check_batch, checks, batch, state_path))
+      if len(pending) >= workers * 2:
+        yield pending.pop(0).result()
+    for future in pending:
+      yield future.result()
+
+def batches_of(items, size):
+  batch = []
+  for item in items:
+    batch.append(item)
+    if len(batch) == size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+# Visits a batch of reports with every check that wants them. Runs in a
+# worker process, so it returns results rather than printing anything:
+#
+#   results, errors - a list for each check
+#   updates - rows for the QA state, for files that were visited, or whose
+#             results were reused after a change of modification time
+#   seen - (check key, path) for each file visited or reused
+def check_batch(checks, reports, state_path=None):
+  results = [[] for check in checks]
+  errors = [[] for check in checks]
+  updates = []
+  seen = []
+  keys = [check.state_key() for check in checks]
+
+  def collect(i, description, method, *args):
+    try:
+      found = method(*args)
+    except Exception as exception:
+      errors[i].append("Error checking %s: %s" % (description, exception))
+      return None
+    found = list(found) if found else []
+    results[i].extend(found)
+    return found
+
+  db = None
+  if state_path and os.path.exists(state_path):
+    db = sqlite3.connect("file:%s?mode=ro" % state_path, uri=True)
+
+  try:
+    for report in reports:
+      wanting = [i for i, check in enumerate(checks) if check.wants(report)]
+      for i in wanting:
+        collect(i, report.path, checks[i].visit_report, report)
+
+      for filename in report.files:
+        path = report.path_for(filename)
+        visitors = []
+        for i in wanting:
+          try:
+            visitor = checks[i].file_visitor(report, filename)
+          except Exception as exception:
+            errors[i].append("Error checking %s: %s" % (path, exception))
+            continue
+          if visitor:
+            visitors.append((i, visitor))
+        if not visitors:
+          continue
+
+        stat = report.stat(filename)
+        if db:
+          visitors = reuse_results(db, keys, path, stat, visitors, results, updates, seen)
+          if not visitors:
+            continue
+
+        try:
+          digest = read_once(path, stat.st_size, [visitor for _, visitor in visitors])
+        except Exception as exception:
+          for i, _ in visitors:
+            errors[i].append("Error checking %s: %s" % (path, exception))
+          continue
+        for i, visitor in visitors:
+          found = collect(i, path, visitor.result)
+          if found is not None:
+            updates.append((keys[i], path, stat.st_size, stat.st_mtime, digest,
+                            pickle.dumps(found)))
+            seen.append((keys[i], path))
+  finally:
+    if db:
+      db.close()
+
+  return results, errors, updates, seen
+
+# Adds the stored results for a file's visitors, where the file hasn't
+# changed since they were stored, and returns the visitors that still have
+# to run. A file with a new modification time but the same size is hashed,
+# and its results reused if the contents are the same after all.
+def reuse_results(db, keys, path, stat, visitors, results, updates, seen):
+  remaining = []
+  touched = []
+  for i, visitor in visitors:
+    row = db.execute("SELECT size, mtime, hash, results FROM results "
+                     "WHERE check_key = ? AND path = ?", (keys[i], path)).fetchone()
+    if row and (row[0] == stat.st_size) and (row[1] == stat.st_mtime):
+      results[i].extend(pickle.loads(row[3]))
+      seen.append((keys[i], path))
+    elif row and (row[0] == stat.st_size) and row[2]:
+      touched.append((i, visitor, row))
+    else:
+      remaining.append((i, visitor))
+
+  if touched:
+    digest = file_hash(path)
+    for i, visitor, row in touched:
+      if row[2] == digest:
+        results[i].extend(pickle.loads(row[3]))
+        updates.append((keys[i], path, stat.st_size, stat.st_mtime, digest, row[3]))
+        seen.append((keys[i], path))
+      else:
+        remaining.append((i, visitor))
+
+  return remaining
+
+def file_hash(path):
+  hash = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(READ_SIZE), b""):
+      hash.update(chunk)
+  return hash.hexdigest()
+
+# Reads a file once, passing each visitor as much of it as it asked for.
+# Returns the file's content hash if all of it was read, or None.
+def read_once(path, size, visitors):
+  remaining = [visitor.max_bytes for visitor in visitors]
+  if all(limit == 0 for limit in remaining):
+    return None
+
+  hash = hashlib.sha256()
+  read = 0
+  with open(path, 'rb') as f:
+    while True:
+      wanted = [limit for limit in remaining if limit != 0]
+      if not wanted:
+        break
+      chunk_size = READ_SIZE
+      if None not in wanted:
+        chunk_size = min(chunk_size, max(wanted))
+      chunk = f.read(chunk_size)
+      if not chunk:
+        break
+      hash.update(chunk)
+      read += len(chunk)
+      for i, visitor in enumerate(visitors):
+        limit = remaining[i]
+        if limit == 0:
+          continue
+        if limit is None:
+          visitor.update(chunk)
+        else:
+          visitor.update(chunk[:limit])
+          remaining[i] = max(0, limit - len(chunk))
+
+  return hash.hexdigest() if read == size else None
@@ -1,6 +1,7 @@
 import os, os.path, errno, sys, traceback, subprocess
 import re, html.entities
 import json
+import hashlib
 import logging
 import yaml
 from bs4 import BeautifulSoup
@@ -14,6 +15,18 @@ import zipfile
 from urllib.parse import urljoin
 import inspect
 import pdfrw
+import collections
+import threading
+import random
+import time
+import email.utils
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
 
 from . import admin
 
@@ -21,7 +34,19 @@ logging.getLogger("pdfrw").setLevel(logging.CRITICAL)
 
 # scraper should be instantiated at class-load time, so that it can rate limit appropriately
 import scrapelib
-scraper = scrapelib.Scraper(requests_per_minute=120, retry_attempts=3)
+
+class Scraper(scrapelib.Scraper):
+  """scrapelib.Scraper whose rate limit also holds when requests are made from
+  several threads at once (see map_concurrently): each request waits its turn
+  for the throttle, while the requests themselves overlap."""
+
+  _throttle_lock = threading.Lock()
+
+  def _throttle(self):
+    with self._throttle_lock:
+      super(Scraper, self)._throttle()
+
+scraper = Scraper(requests_per_minute=120, retry_attempts=3)
 scraper.user_agent = "unitedstates/inspectors-general (https://github.com/unitedstates/inspectors-general)"
 scraper.timeout = 60
 
@@ -33,6 +58,9 @@ class Soft404HttpAdapter(requests.adapters.HTTPAdapter):
     "si.edu": b"<title>Page Not FoundSmithsonian</title>",
   }
 
+  # only the start of the page is searched for the signature
+  SOFT_404_SEARCH_BYTES = 10240
+
   def build_response(self, req, resp):
     domain = urllib.parse.urlparse(req.url)[1].split(':')[0]
     base_domain = ".".join(domain.split(".")[-2:])
@@ -57,7 +85,7 @@ class Soft404HttpAdapter(requests.adapters.HTTPAdapter):
                 strict=resp.strict,
                 preload_content=False,
         )
-        if decompressed_data.find(self.SOFT_404_BODY_SIGNATURES[base_domain], 0, 10240) != -1:
+        if decompressed_data.find(self.SOFT_404_BODY_SIGNATURES[base_domain], 0, self.SOFT_404_SEARCH_BYTES) != -1:
           result = super(Soft404HttpAdapter, self).build_response(req, resp)
           result.status_code = 404 # tells scrapelib to not retry
           return result
@@ -126,6 +154,9 @@ def run(run_method, additional=None):
     return run_method(cli_options)
   except Exception as exception:
     admin.log_exception(exception)
+  finally:
+    last_modified_cache.save()
+    sync_writes()
 
 
 # read options from the command line
@@ -136,24 +167,43 @@ AVAILABLE_OPTIONS = (
   "bulk",
   "component",
   "debug",
+  "delta",
   "dry_run",
   "end",
+  "force",
+  "format",
   "ig",
+  "index",
+  "jobs",
   "limit",
   "log",
+  "meta",
   "only",
+  "output",
   "pages",
   "quick",
   "report_id",
+  "resume",
   "safe",
+  "shard",
   "since",
   "skip_downloaded",
+  "split",
   "start",
   "topics",
   "types",
+  "update",
+  "workers",
   "year",
 )
 
+# options whose values are paths, and so keep their case
+PATH_OPTIONS = (
+  "bulk",
+  "index",
+  "output",
+)
+
 
 def options():
   options = {}
@@ -161,13 +211,14 @@ def options():
     if arg.startswith("--"):
 
       if "=" in arg:
-        key, value = arg.split('=')
+        key, value = arg.split('=', 1)
       else:
         key, value = arg, "true"
 
       key = key.split("--")[1]
       key = key.lower()
-      value = value.lower()
+      if (key not in PATH_OPTIONS) or (value.lower() in ('true', 'false')):
+        value = value.lower()
 
       if key not in AVAILABLE_OPTIONS:
         print("Unknown option: \"%s\"\n"
@@ -228,7 +279,13 @@ def download(url, destination=None, options=None, scraper_slug=None):
         mkdir_p(os.path.dirname(destination))
 
         verify_options = domain_verify_options(url)
-        scraper.urlretrieve(url, destination, verify=verify_options)
+        temp_path = temp_path_for(destination)
+        try:
+          scraper.urlretrieve(url, temp_path, verify=verify_options)
+          os.replace(temp_path, destination)
+        finally:
+          remove_if_exists(temp_path)
+        mark_unsynced(destination)
       except connection_errors() as e:
         admin.log_http_error(e, url, scraper_slug)
         return None
@@ -273,22 +330,169 @@ def download(url, destination=None, options=None, scraper_slug=None):
     # whether from disk or web, unescape HTML entities
     return unescape(body)
 
-def beautifulsoup_from_url(url):
+# Keeps the pages most recently fetched through beautifulsoup_from_url(...,
+# memoize=True) for the rest of the run, keyed by URL, so a scraper that needs
+# the same page twice (e.g. once for its pagination links and once for its
+# reports) only downloads it once. Concurrent requests for the same URL wait
+# for the first one instead of fetching it again.
+class PageMemo(object):
+  def __init__(self, size):
+    self.size = size
+    self.entries = collections.OrderedDict()
+    self.lock = threading.Lock()
+    self.url_locks = {}
+
+  # returns a dict with the page's "body" and, once parsed, its "doc",
+  # or None if the page couldn't be fetched
+  def fetch(self, url, fetch_body):
+    with self.lock:
+      entry = self.get(url)
+      if entry:
+        return entry
+      url_lock = self.url_locks.setdefault(url, threading.Lock())
+
+    with url_lock:
+      with self.lock:
+        entry = self.get(url)
+      if entry:
+        return entry
+
+      body = fetch_body()
+
+      with self.lock:
+        self.url_locks.pop(url, None)
+        if body is None:
+          return None
+        entry = {"body": body, "doc": None}
+        self.entries[url] = entry
+        while len(self.entries) > self.size:
+          self.entries.popitem(last=False)
+        return entry
+
+  def get(self, url):
+    entry = self.entries.get(url)
+    if entry:
+      self.entries.move_to_end(url)
+    return entry
+
+  def forget(self, url):
+    with self.lock:
+      self.entries.pop(url, None)
+
+PAGE_MEMO_SIZE = 100
+page_memo = PageMemo(PAGE_MEMO_SIZE)
+
+# memoize: reuse the page body if this URL was already fetched this run.
+# shared_tree: also reuse the parsed document itself, which saves parsing it
+#   again but means every caller gets the same object, so callers must not
+#   modify it. Implies memoize.
+def beautifulsoup_from_url(url, memoize=False, shared_tree=False):
   caller_filename = inspect.stack()[1][1]
   caller_scraper = os.path.splitext(os.path.basename(caller_filename))[0]
 
-  body = download(url, scraper_slug=caller_scraper)
-  if body is None: return None
+  if memoize or shared_tree:
+    entry = page_memo.fetch(url, lambda: download(url, scraper_slug=caller_scraper))
+    if entry is None: return None
 
-  doc = BeautifulSoup(body, "lxml")
+    if shared_tree:
+      if entry["doc"] is None:
+        entry["doc"] = BeautifulSoup(entry["body"], "lxml")
+      doc = entry["doc"]
+    else:
+      doc = BeautifulSoup(entry["body"], "lxml")
+  else:
+    body = download(url, scraper_slug=caller_scraper)
+    if body is None: return None
+
+    doc = BeautifulSoup(body, "lxml")
 
   # Some of the pages will return meta refreshes
   if doc.find("meta") and doc.find("meta").attrs.get('http-equiv') == 'REFRESH':
     redirect_url = urljoin(url, doc.find("meta").attrs['content'].split("url=")[1])
-    return beautifulsoup_from_url(redirect_url)
+    return beautifulsoup_from_url(redirect_url, memoize=memoize, shared_tree=shared_tree)
   else:
     return doc
 
+# Calls function on each of items using a pool of worker threads, and returns
+# the results in the same order as items. Meant for the network-bound parts of
+# scrapers, like looking up details for every row of a listing page; requests
+# made through the shared scraper still respect its rate limit.
+FETCH_WORKERS = 4
+
+def map_concurrently(function, items, workers=FETCH_WORKERS):
+  items = list(items)
+  if workers <= 1 or len(items) <= 1:
+    return [function(item) for item in items]
+  with ThreadPoolExecutor(max_workers=min(workers, len(items))) as pool:
+    return list(pool.map(function, items))
+
+# Some sites intermittently serve pages that look fine to HTTP but are
+# missing their content, e.g. an empty listing or a "cannot be displayed at
+# this time" message. retry() calls fetch() until is_valid(result) is true,
+# or the policy's attempts run out, and returns the last result either way,
+# so callers decide what an invalid page means. None is never valid.
+#
+# Between attempts it waits with exponential backoff and full jitter, or for
+# as long as the server asked with a Retry-After header, if that's longer.
+# Only the calling thread waits: rows being fetched alongside it (see
+# map_concurrently and inspector.resolve_landing_pages) carry on.
+class RetryPolicy(object):
+  def __init__(self, attempts=5, base_delay=2, max_delay=120):
+    self.attempts = attempts
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+
+  def delay(self, attempt, retry_after=None):
+    delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+    if retry_after is not None:
+      delay = max(delay, min(retry_after, self.max_delay))
+    return delay
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+def retry(fetch, is_valid=None, policy=DEFAULT_RETRY_POLICY, description=None):
+  result = None
+  for attempt in range(policy.attempts):
+    _last_response.value = None
+    result = fetch()
+    if (result is not None) and ((is_valid is None) or is_valid(result)):
+      return result
+
+    if attempt + 1 < policy.attempts:
+      delay = policy.delay(attempt, retry_after_from(_last_response.value))
+      logging.warn("Invalid response%s, retrying in %.1fs (attempt %i of %i)" %
+                   (" from %s" % description if description else "", delay,
+                    attempt + 2, policy.attempts))
+      time.sleep(delay)
+  return result
+
+# the last response received by each thread, for its Retry-After header
+_last_response = threading.local()
+
+def remember_response(response, *args, **kwargs):
+  _last_response.value = response
+
+scraper.hooks['response'].append(remember_response)
+
+# Retry-After is either a number of seconds or an HTTP date
+def retry_after_from(response):
+  if response is None:
+    return None
+  value = response.headers.get('Retry-After')
+  if not value:
+    return None
+  try:
+    return max(0, int(value))
+  except ValueError:
+    pass
+  try:
+    retry_at = email.utils.parsedate_to_datetime(value)
+  except (TypeError, ValueError):
+    return None
+  if retry_at is None:
+    return None
+  return max(0, retry_at.timestamp() - time.time())
+
 def post(url, data=None, headers=None, **kwargs):
   response = None
   try:
@@ -307,6 +511,134 @@ def resolve_redirect(url):
   else:
     return url
 
+# Some scrapers fall back to a report's Last-Modified header when there is no
+# other date for it. Those headers are kept in LAST_MODIFIED_CACHE, under the
+# data directory, across runs, so once a URL has been dated it is never asked
+# for again. utils.run() saves any new ones at the end of the run.
+#
+# Scrapers run side by side (see `igs --workers`) share the file, so saving
+# re-reads it under a lock and only adds this run's headers to it. A URL that
+# answered without a Last-Modified header is cached as null; one whose HEAD
+# request failed is cached as {"failed_at": <timestamp>}, and tried again
+# after LAST_MODIFIED_RETRY_AFTER seconds.
+LAST_MODIFIED_CACHE = ".last_modified.json"
+LAST_MODIFIED_RETRY_AFTER = 7 * 24 * 60 * 60
+
+class LastModifiedCache(object):
+  def __init__(self, filename):
+    self.filename = filename
+    self.headers = None
+    self.new = {}
+    self.lock = threading.Lock()
+
+  def path(self):
+    return os.path.join(data_dir(), self.filename)
+
+  # read lazily, so that the data directory has been configured by then
+  def load(self):
+    if self.headers is None:
+      self.headers = self.read()
+
+  def read(self):
+    if os.path.exists(self.path()):
+      try:
+        with open(self.path(), 'r', encoding='utf-8') as f:
+          return json.load(f)
+      except ValueError:
+        logging.warn("Ignoring unreadable Last-Modified cache %s" % self.path())
+    return {}
+
+  # returns (whether the URL is cached, its header or None)
+  def lookup(self, url):
+    with self.lock:
+      self.load()
+      if url not in self.headers:
+        return False, None
+      value = self.headers[url]
+      if isinstance(value, dict):
+        return (time.time() - value.get("failed_at", 0) < LAST_MODIFIED_RETRY_AFTER), None
+      return True, value
+
+  # header is None for a response without a Last-Modified header
+  def set(self, url, header):
+    self.store(url, header)
+
+  def set_failed(self, url):
+    self.store(url, {"failed_at": time.time()})
+
+  def store(self, url, value):
+    with self.lock:
+      self.load()
+      self.headers[url] = value
+      self.new[url] = value
+
+  def save(self):
+    with self.lock:
+      if not self.new:
+        return
+      with locked(self.path() + ".lock"):
+        headers = self.read()
+        headers.update(self.new)
+        write(json.dumps(headers, sort_keys=True, indent=2), self.path())
+      self.headers = headers
+      self.new = {}
+
+last_modified_cache = LastModifiedCache(LAST_MODIFIED_CACHE)
+
+# holds an exclusive lock on path (a file created for it) against other
+# processes, where the platform has fcntl
+@contextlib.contextmanager
+def locked(path):
+  if fcntl is None:
+    yield
+    return
+  if os.path.dirname(path):
+    mkdir_p(os.path.dirname(path))
+  with open(path, 'a') as f:
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+# Returns a dict of url -> datetime from each URL's Last-Modified header, or
+# None if there isn't one (or the request failed). URLs that aren't cached yet
+# are requested with HEAD, several at a time.
+def last_modified(urls, workers=FETCH_WORKERS):
+  caller_filename = inspect.stack()[1][1]
+  caller_scraper = os.path.splitext(os.path.basename(caller_filename))[0]
+
+  failed = object()
+  def head(url):
+    try:
+      response = scraper.request(method='HEAD', url=url)
+    except connection_errors() as e:
+      admin.log_http_error(e, url, caller_scraper)
+      return failed
+    return response.headers.get('Last-Modified')
+
+  headers = {}
+  uncached = []
+  for url in urls:
+    cached, headers[url] = last_modified_cache.lookup(url)
+    if not cached:
+      uncached.append(url)
+  for url, header in zip(uncached, map_concurrently(head, uncached, workers=workers)):
+    if header is failed:
+      last_modified_cache.set_failed(url)
+      header = None
+    else:
+      last_modified_cache.set(url, header)
+    headers[url] = header
+
+  dates = {}
+  for url, header in headers.items():
+    try:
+      dates[url] = datetime.strptime(header, '%a, %d %b %Y %H:%M:%S %Z')
+    except (TypeError, ValueError):
+      dates[url] = None
+  return dates
+
 def connection_errors():
   return (scrapelib.HTTPError, requests.exceptions.ConnectionError, requests.packages.urllib3.exceptions.MaxRetryError)
 
@@ -393,16 +725,21 @@ def text_from_pdf(real_pdf_path, real_text_path):
                  "your PATH environment variable.")
     return
 
+  temp_text_path = temp_path_for(real_text_path)
   try:
     subprocess.check_call(["pdftotext",
                            "-layout",
                            "-nopgbrk",
                            real_pdf_path,
-                           real_text_path], shell=False)
+                           temp_text_path], shell=False)
+    os.replace(temp_text_path, real_text_path)
+    mark_unsynced(real_text_path)
   except subprocess.CalledProcessError as exc:
     logging.warn("Error extracting text to %s:\n\n%s" %
                  (real_text_path, format_exception(exc)))
     return
+  finally:
+    remove_if_exists(temp_text_path)
 
   if not os.path.exists(real_text_path):
     logging.warn("Text not extracted to %s" % real_text_path)
@@ -649,15 +986,173 @@ def data_dir():
     return admin.config.get('data_directory')
   return "data"
 
+# A data/<inspector>/<year>/<report_id> directory, as found by iter_reports().
+# The files in it are listed once, as os.DirEntry objects, so their type and
+# stat() results are cached, rather than looked up again by each caller.
+class ReportDir(object):
+  def __init__(self, inspector, year, report_id, path, files=None):
+    self.inspector = inspector
+    self.year = year
+    self.report_id = report_id
+    self.path = path
+    self._files = files
+
+  # filename -> os.DirEntry, for each file in the directory
+  @property
+  def files(self):
+    if self._files is None:
+      self._files = report_files(self.path)
+    return self._files
+
+  # inspector/year/report_id, the same whatever the data directory is
+  @property
+  def relative_path(self):
+    return os.path.join(self.inspector, self.year, self.report_id)
+
+  def has(self, filename):
+    return filename in self.files
+
+  def path_for(self, filename):
+    return os.path.join(self.path, filename)
+
+  # returns None if there's no such file
+  def stat(self, filename):
+    entry = self.files.get(filename)
+    return entry.stat() if entry else None
+
+  # raises ValueError if report.json is missing or invalid
+  def metadata(self):
+    if not self.has("report.json"):
+      raise ValueError("No report.json in %s" % self.path)
+    with open(self.path_for("report.json"), 'r', encoding='utf-8') as f:
+      return json.load(f)
+
+# Yields a ReportDir for each report saved in data_dir, by inspector, year
+# and report_id, optionally limited to some inspectors. Hidden files and
+# directories (caches, temporary files) and directories that aren't years
+# are skipped.
+#
+# With workers, that many inspector directories are listed at once, on
+# threads; the reports still come out in order. With list_files=False, the
+# files in each report directory are only listed if they're asked for.
+def iter_reports(data_dir, inspectors=None, workers=None, list_files=True):
+  names = inspector_names(data_dir, inspectors)
+  scan = lambda inspector: scan_inspector(data_dir, inspector, list_files)
+  if workers and (len(names) > 1):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+      for reports in pool.map(scan, names):
+        yield from reports
+  else:
+    for inspector in names:
+      yield from scan(inspector)
+
+# the inspector directories in data_dir, optionally limited to some inspectors
+def inspector_names(data_dir, inspectors=None):
+  if not os.path.isdir(data_dir):
+    return []
+  return [entry.name for entry in visible_entries(data_dir)
+          if entry.is_dir() and ((not inspectors) or (entry.name in inspectors))]
+
+def scan_inspector(data_dir, inspector, list_files=True):
+  reports = []
+  inspector_path = os.path.join(data_dir, inspector)
+  for year_entry in visible_entries(inspector_path):
+    if not (year_entry.is_dir() and year_entry.name.isdigit()):
+      continue
+    for report_entry in visible_entries(year_entry.path):
+      if not report_entry.is_dir():
+        continue
+      files = report_files(report_entry.path) if list_files else None
+      reports.append(ReportDir(inspector, year_entry.name, report_entry.name,
+                               report_entry.path, files))
+  return reports
+
+def report_files(path):
+  return collections.OrderedDict((entry.name, entry) for entry in visible_entries(path)
+                                 if entry.is_file())
+
+# the entries in a directory, sorted by name, without hidden ones
+def visible_entries(path):
+  with os.scandir(path) as it:
+    entries = [entry for entry in it if not entry.name.startswith(".")]
+  entries.sort(key=lambda entry: entry.name)
+  return entries
+
+# Files are written to a temporary path next to the destination and then
+# renamed over it, so a crash mid-write never leaves a truncated file behind
+# for the cache checks in download() and extract_report() to trust.
+#
+# Flushing to stable storage is deferred to sync_writes(), which utils.run()
+# calls once at the end of each scraper run, rather than once per file.
+_unsynced_paths = set()
+_unsynced_lock = threading.Lock()
+
 def write(content, destination, binary=False):
-  mkdir_p(os.path.dirname(destination))
+  if os.path.dirname(destination):
+    mkdir_p(os.path.dirname(destination))
 
-  if binary:
-    f = open(destination, 'bw')
-  else:
-    f = open(destination, 'w', encoding='utf-8')
-  f.write(content)
-  f.close()
+  temp_path = temp_path_for(destination)
+  try:
+    if binary:
+      f = open(temp_path, 'bw')
+    else:
+      f = open(temp_path, 'w', encoding='utf-8')
+    with f:
+      f.write(content)
+    os.replace(temp_path, destination)
+  finally:
+    remove_if_exists(temp_path)
+
+  mark_unsynced(destination)
+
+# hidden, per-process and per-thread sibling of the destination, on the same
+# filesystem so that os.replace() is an atomic rename
+def temp_path_for(destination):
+  directory, filename = os.path.split(destination)
+  return os.path.join(directory, ".%s.%i.%i.tmp" % (filename, os.getpid(), threading.get_ident()))
+
+def remove_if_exists(path):
+  try:
+    os.remove(path)
+  except FileNotFoundError:
+    pass
+
+# remember a file that was renamed into place, for sync_writes()
+def mark_unsynced(path):
+  with _unsynced_lock:
+    _unsynced_paths.add(path)
+
+# make everything written since the last call durable: fsync each file, then
+# each directory they were renamed into (once), so the new directory entries
+# are durable too. directories can't be fsynced everywhere (e.g. Windows), so
+# errors there are ignored.
+def sync_writes():
+  global _unsynced_paths
+  with _unsynced_lock:
+    paths, _unsynced_paths = _unsynced_paths, set()
+  if not paths:
+    return
+
+  directories = set()
+  for path in paths:
+    try:
+      with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+    except OSError:
+      continue
+    directories.add(os.path.dirname(os.path.abspath(path)))
+
+  for directory in directories:
+    try:
+      fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+      continue
+    try:
+      os.fsync(fd)
+    except OSError:
+      pass
+    finally:
+      os.close(fd)
 
 def json_for(object):
   return json.dumps(object, sort_keys=True, indent=2, default=format_datetime)
@@ -714,3 +1209,33 @@ def unescape(text):
 # 'safe' scrapers listed in safe.yml
 def safe_igs():
   return yaml.load(open("safe.yml"))
+
+# igs --shard=i/N splits a run over N machines. Most IGs are assigned to a
+# shard whole, while IGs in LARGE_IGS are split up by year, and each of their
+# years is assigned on its own. The assignment only depends on the IG, the
+# year and N, so that every shard (and merge-shards) agrees on it.
+#
+# Only IGs whose listings are fetched a year (or date range) at a time belong
+# here: a scraper that crawls its whole listing and then filters the rows by
+# year (like doj and hhs) would crawl all of it again for every year.
+LARGE_IGS = ("dod", "gaoreports")
+
+# returns the shard, from 1 to shard_count, that scrapes ig (in year, for
+# large IGs)
+def shard_for(ig, year, shard_count):
+  if ig in LARGE_IGS and (year is not None):
+    key = "%s/%s" % (ig, year)
+  else:
+    key = ig
+  digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+  return (int(digest, 16) % shard_count) + 1
+
+# parses "i/N" into (i, N)
+def parse_shard(value):
+  try:
+    index, count = [int(part) for part in value.split("/")]
+  except ValueError:
+    raise ValueError("Shards are given as i/N, e.g. --shard=2/4")
+  if not (1 <= index <= count):
+    raise ValueError("Shard %i/%i is out of range, shards are numbered from 1 to %i" % (index, count, count))
+  return index, count
@@ -4,7 +4,6 @@ import datetime
 import logging
 import os
 import re
-import time
 
 from utils import utils, inspector, admin
 
@@ -49,7 +48,9 @@ AGENCY_SLUG_MAP = {
   "Office of the Secretary": "OSVA",
 }
 
-MAX_ATTEMPTS = 5
+# Pages on this site intermittently come back without their contents, so they
+# are retried with backoff until they look right
+RETRY_POLICY = utils.RetryPolicy(attempts=5, base_delay=10)
 ERROR_TEXT_SUMMARY = 'This report summary cannnot be displayed at this time.'
 ERROR_TEXT_LIST = 'Reports are not available at this time.'
 
@@ -59,16 +60,9 @@ def run(options):
 
   # Pull the audit reports
   for page in range(1, 1000):
-    # Intermittent errors are indistinguishable from reaching the end of the
-    # reports. In both cases, the "content" div only contains an empty div with
-    # class "search-results-pagination". Thus, we will always retry pages that
-    # look like this.
     url = "{}?RS={}".format(REPORTS_URL, page)
-    for attempt in range(MAX_ATTEMPTS):
-      doc = utils.beautifulsoup_from_url(url)
-      if doc.select(".layout-content_area")[0].text.strip():
-        break
-      time.sleep(30)
+    doc = utils.retry(lambda: utils.beautifulsoup_from_url(url),
+                      listing_is_valid, RETRY_POLICY, url)
 
     results = doc.select(".report")
     if not results:
@@ -76,19 +70,16 @@ def run(options):
         raise inspector.NoReportsFoundError("VA (audit reports)")
       else:
         break
-    for result in results:
-      report = report_from(result, year_range)
+    reports = inspector.resolve_landing_pages(
+      results, lambda result: report_from(result, year_range), landing_url_for)
+    for report in reports:
       if report:
         inspector.save_report(report)
 
   # Pull the semiannual reports
-  for attempt in range(MAX_ATTEMPTS):
-    doc = utils.beautifulsoup_from_url(SEMIANNUAL_REPORTS_URL)
-    page_text = doc.select("div.single-column-report-list")[0].text.strip()
-    if page_text != ERROR_TEXT_LIST:
-      break
-    time.sleep(30)
-  if page_text == ERROR_TEXT_LIST:
+  doc = utils.retry(lambda: utils.beautifulsoup_from_url(SEMIANNUAL_REPORTS_URL),
+                    semiannual_list_is_valid, RETRY_POLICY, SEMIANNUAL_REPORTS_URL)
+  if not (doc and semiannual_list_is_valid(doc)):
     raise Exception("Could not retrieve semiannual reports list")
 
   results = doc.select(".sar")
@@ -100,6 +91,24 @@ def run(options):
       inspector.save_report(report)
 
 
+# Intermittent errors are indistinguishable from reaching the end of the
+# reports. In both cases, the "content" div only contains an empty div with
+# class "search-results-pagination". Thus, we will always retry pages that
+# look like this.
+def listing_is_valid(doc):
+  return bool(doc.select(".layout-content_area")[0].text.strip())
+
+
+def semiannual_list_is_valid(doc):
+  page_text = doc.select("div.single-column-report-list")[0].text.strip()
+  return page_text != ERROR_TEXT_LIST
+
+
+def summary_is_valid(doc):
+  page_text = doc.select(".report_summary-value")[0].text.strip()
+  return page_text != ERROR_TEXT_SUMMARY
+
+
 def report_type_from_topic(topic):
   if "Audit" in topic or topic in ["CAP Reviews", "CBOC Reports"]:
     return 'audit'
@@ -113,12 +122,15 @@ def report_type_from_topic(topic):
     return 'other'
 
 
+def landing_url_for(result):
+  landing_url = result.select("p.report-summary a.report-summary-link")[0].get('href')
+  return re.sub("^http://www.va.gov/", "https://www.va.gov/", landing_url)
+
+
 def report_from(result, year_range):
   link = result.select("a")[0]
   title = link.text
-  landing_url = result.select("p.report-summary a.report-summary-link")[0].get('href')
-  landing_url = re.sub("^http://www.va.gov/", "https://www.va.gov/",
-                       landing_url)
+  landing_url = landing_url_for(result)
   published_on_text = result.select("p.report-summary")[0].text.split("|")[0].strip()
   published_on = datetime.datetime.strptime(published_on_text, "%m/%d/%Y")
 
@@ -133,13 +145,9 @@ def report_from(result, year_range):
 
   # These pages occassionally return text indicating there was a temporary
   # error so we will retry if necessary.
-  for attempt in range(MAX_ATTEMPTS):
-    landing_page = utils.beautifulsoup_from_url(landing_url)
-    page_text = landing_page.select(".report_summary-value")[0].text.strip()
-    if page_text != ERROR_TEXT_SUMMARY:
-      break
-    time.sleep(30)
-  if page_text == ERROR_TEXT_SUMMARY:
+  landing_page = utils.retry(lambda: utils.beautifulsoup_from_url(landing_url),
+                             summary_is_valid, RETRY_POLICY, landing_url)
+  if not (landing_page and summary_is_valid(landing_page)):
     raise Exception("Could not retrieve url %s" % landing_url)
 
   field_mapping = {}
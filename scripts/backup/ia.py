@@ -13,6 +13,11 @@
 import internetarchive
 import os, sys, traceback
 import json, logging, requests
+import hashlib
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from utils import utils
 
 # The unique collection ID, assigned by Internet Archive staff.
 COLLECTION_NAME = "usinspectorsgeneral"
@@ -20,12 +25,51 @@ COLLECTION_NAME = "usinspectorsgeneral"
 # The special item ID for the bulk download file, chosen by Eric.
 BULK_ITEM_NAME = "us-inspectors-general.bulk"
 
+# Which items have been uploaded, one JSON object per line, appended to as
+# each upload finishes:
+#
+#   {"item_id": ..., "files": {"report.pdf": {"size": ..., "mtime": ...,
+#    "sha256": ...}, ...}, "sha256": <hash of all the files>,
+#    "uploaded_at": ...}
+#
+# The last line for an item wins. A report is uploaded again when the
+# contents of its report.* files change. Reports used to be marked with an
+# ia.done file in their directory instead; those are taken to mean the files
+# as they are now were uploaded, and are moved into the manifest without
+# hashes (null), so they're sent again if their size or time changes.
+MANIFEST_PATH = "data/.ia_manifest.jsonl"
 
+# each report's upload is tried this many times in all
+RETRY_POLICY = utils.RetryPolicy(attempts=3, base_delay=5, max_delay=60)
+
+
+# back up reports, given as (ig, year, report_id), up to jobs at a time.
+# a report whose upload fails is retried with backoff. returns the reports
+# that couldn't be backed up.
+#
+# checked: the reports are already known not to be backed up as they are now,
+# e.g. by already_uploaded()
+def backup_reports(reports, options, jobs=1, policy=RETRY_POLICY, checked=False):
+  with ThreadPoolExecutor(max_workers=jobs) as pool:
+    results = list(pool.map(lambda report: backup_with_retries(report, options, policy, checked), reports))
+  return [report for report, success in zip(reports, results) if not success]
+
+# returns whether the report was backed up
+def backup_with_retries(report, options, policy=RETRY_POLICY, checked=False):
+  def attempt():
+    try:
+      return backup_report(*report, options=options, checked=checked) or None
+    except Exception as exception:
+      logging.warn("[%s][%s][%s] Error backing up: %s" % (report + (exception,)))
+      return None
+
+  return utils.retry(attempt, policy=policy, description="/".join(report)) is not None
 
 # given an IG report, a year, and its report_id:
 # create an item in the Internet Archive
-def backup_report(ig, year, report_id, options=None):
+def backup_report(ig, year, report_id, options=None, checked=False):
   if options is None: options = {}
+  force = (options.get("force") is True)
 
   logging.warn("")
 
@@ -35,7 +79,8 @@ def backup_report(ig, year, report_id, options=None):
     logging.warn("[%s][%s][%s] Unreleased report, skipping." % (ig, year, report_id))
     return True
 
-  if already_uploaded(ig, year, report_id) and (options.get("force") is not True):
+  # checked: the caller already found it isn't backed up as it is now
+  if (not force) and (not checked) and already_uploaded(ig, year, report_id):
     logging.warn("[%s][%s][%s] Already backed up, skipping." % (ig, year, report_id))
     return True
 
@@ -43,9 +88,12 @@ def backup_report(ig, year, report_id, options=None):
   item_id = item_id_for(ig, year, report_id)
   item = internetarchive.get_item(item_id)
 
-  if item.exists and (options.get("force") is not True):
+  # an item that's in the manifest has changed since it was uploaded, and is
+  # sent again; one that isn't was uploaded without being recorded
+  if item.exists and (not force) and (manifest.get(item_id) is None):
     logging.warn("[%s][%s][%s] Ooooops, item does exist. Marking as done, and stopping." % (ig, year, report_id))
-    mark_as_uploaded(ig, year, report_id)
+    if not options.get("dry_run"):
+      mark_as_uploaded(ig, year, report_id)
     return True
 
   metadata = collection_metadata()
@@ -83,7 +131,11 @@ def backup_report(ig, year, report_id, options=None):
       return False
 
   logging.warn("[%s][%s][%s] :) Uploaded:\n%s" % (ig, year, report_id, ia_url_for(item_id)))
-  mark_as_uploaded(ig, year, report_id)
+
+  # only record what was actually sent: nothing on a dry run, and only the
+  # metadata file with --meta
+  if not options.get("dry_run"):
+    mark_as_uploaded(ig, year, report_id, sent=(["report.json"] if options.get("meta") else None))
 
   return True
 
@@ -205,7 +257,9 @@ def upload_files(item, paths, metadata, options):
 
       verbose=True, # I love output
       queue_derive=queue_derive, # don't put it into IA's derivation queue
-      ignore_preexisting_bucket=True, # always overwrite
+      # always overwrite. (newer versions of internetarchive dropped the
+      # ignore_preexisting_bucket argument that set this header)
+      headers={'x-archive-ignore-preexisting-bucket': '1'},
 
       retries=3, # it'd be nicer to look up the actual rate limit
       retries_sleep=2
@@ -214,6 +268,9 @@ def upload_files(item, paths, metadata, options):
     format_exception(exc)
     return False
 
+def report_dir(ig, year, report_id):
+  return "data/%s/%s/%s" % (ig, year, report_id)
+
 def file_path(ig, year, report_id, file_type):
   return "data/%s/%s/%s/report.%s" % (ig, year, report_id, file_type)
 
@@ -223,11 +280,136 @@ def metadata_path(ig, year, report_id):
 def marker_path(ig, year, report_id):
   return "data/%s/%s/%s/ia.done" % (ig, year, report_id)
 
-def already_uploaded(ig, year, report_id):
-  return os.path.exists(marker_path(ig, year, report_id))
+# the upload manifest, safe to record uploads in from several threads
+class Manifest(object):
+
+  def __init__(self, path):
+    self.path = path
+    self.uploaded = None
+    self.lock = threading.Lock()
+
+  def load(self):
+    if self.uploaded is None:
+      self.uploaded = {}
+      if os.path.exists(self.path):
+        with open(self.path, 'r', encoding='utf-8') as f:
+          for line in f:
+            try:
+              entry = json.loads(line)
+            except ValueError:
+              # e.g. a line cut short by a crash
+              continue
+            self.uploaded[entry['item_id']] = entry
+
+  def get(self, item_id):
+    with self.lock:
+      self.load()
+      return self.uploaded.get(item_id)
+
+  def record(self, entry):
+    with self.lock:
+      self.load()
+      with open(self.path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, sort_keys=True) + "\n")
+      self.uploaded[entry['item_id']] = entry
+
+manifest = Manifest(MANIFEST_PATH)
+
+# the report.* files in a report's directory, and their stats
+def report_stats(ig, year, report_id):
+  directory = report_dir(ig, year, report_id)
+  stats = {}
+  for name in os.listdir(directory):
+    if name.startswith("report."):
+      stats[name] = os.stat(os.path.join(directory, name))
+  return stats
+
+# stats: the report's files, as given by report_stats(), if already known
+def already_uploaded(ig, year, report_id, stats=None):
+  if stats is None:
+    stats = report_stats(ig, year, report_id)
+
+  entry = manifest.get(item_id_for(ig, year, report_id))
+  if (entry is None) or ('files' not in entry):
+    if (entry is None) and not os.path.exists(marker_path(ig, year, report_id)):
+      return False
+    # uploaded before the manifest kept hashes: trust that it was the files
+    # as they are now, without hashing them
+    mark_as_uploaded(ig, year, report_id, stats, hash_files=False)
+    return True
+
+  files = entry['files']
+  if set(files.keys()) != set(stats.keys()):
+    return False
+
+  # only hash the files that look different from when they were uploaded
+  hashes = {}
+  for name, stat in stats.items():
+    if (files[name]['size'] == stat.st_size) and (files[name]['mtime'] == stat.st_mtime):
+      hashes[name] = files[name]['sha256']
+    elif (files[name]['size'] != stat.st_size) or (files[name]['sha256'] is None):
+      return False
+    else:
+      hashes[name] = file_hash(os.path.join(report_dir(ig, year, report_id), name))
+      if hashes[name] != files[name]['sha256']:
+        return False
+
+  # the files were only touched; keep their new times, to not hash them again
+  if any(files[name]['mtime'] != stat.st_mtime for name, stat in stats.items()):
+    mark_as_uploaded(ig, year, report_id, stats, hashes, entry['uploaded_at'])
+  return True
 
-def mark_as_uploaded(ig, year, report_id):
-  open(marker_path(ig, year, report_id), "w").close()
+# hash_files: whether to hash the files, or record them without hashes (for
+# reports trusted to be uploaded, which are then sent again on any change)
+# sent: the names of the files uploaded, if not all of them. The others keep
+# what the manifest had for them, if anything, so a report whose files were
+# never all sent isn't taken to be backed up.
+def mark_as_uploaded(ig, year, report_id, stats=None, hashes=None, uploaded_at=None,
+                     hash_files=True, sent=None):
+  if stats is None:
+    stats = report_stats(ig, year, report_id)
+  if hashes is None:
+    hashes = {}
+  if uploaded_at is None:
+    uploaded_at = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+  previous = {}
+  if sent is not None:
+    previous = (manifest.get(item_id_for(ig, year, report_id)) or {}).get('files', {})
+
+  files = {}
+  for name, stat in stats.items():
+    if (sent is not None) and (name not in sent):
+      if name in previous:
+        files[name] = previous[name]
+      continue
+    sha256 = hashes.get(name)
+    if (sha256 is None) and hash_files:
+      sha256 = file_hash(os.path.join(report_dir(ig, year, report_id), name))
+    files[name] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': sha256}
+
+  manifest.record({
+    'item_id': item_id_for(ig, year, report_id),
+    'files': files,
+    'sha256': combined_hash(files),
+    'uploaded_at': uploaded_at,
+  })
+
+def file_hash(path):
+  hash = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+      hash.update(chunk)
+  return hash.hexdigest()
+
+# None unless every file has been hashed
+def combined_hash(files):
+  if any(files[name]['sha256'] is None for name in files):
+    return None
+  hash = hashlib.sha256()
+  for name in sorted(files.keys()):
+    hash.update(("%s %s\n" % (files[name]['sha256'], name)).encode("utf-8"))
+  return hash.hexdigest()
 
 def ia_url_for(item_id):
   return "https://archive.org/details/%s" % item_id
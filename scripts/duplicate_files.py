@@ -2,21 +2,107 @@
 
 import hashlib
 import os, os.path
-from inspectors.utils import utils
-import logging
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from inspectors.utils import utils, qa
+
+# Files can only be identical if they are the same size, so files are first
+# grouped by size, and only files that share a size are read at all. Those
+# are compared by a cheap hash of their first and last QUICK_HASH_BYTES, and
+# only files that still collide get a full SHA-256. Each round of hashing is
+# spread across a thread pool in one batch, and digests are kept with the
+# other QA results (see qa.QAState), keyed by path, size and modification
+# time, so unchanged files are never re-read on later runs.
+
+QUICK_HASH_BYTES = 64 * 1024
+WORKERS = 8
 
 class Deduplicator(object):
-  def __init__(self):
-    self.hashes_to_names = {}
-
-  def add_and_check_file(self, filename):
-    hash = self.file_to_hash(filename)
-    if hash in self.hashes_to_names:
-      self.hashes_to_names[hash].append(filename)
-      return self.hashes_to_names[hash]
-    else:
-      self.hashes_to_names[hash] = [filename]
+  def __init__(self, state_path=qa.STATE_PATH, key="DuplicateFiles", workers=WORKERS):
+    self.workers = workers
+    self.keys = {kind: "%s/%s" % (key, kind) for kind in ("quick", "full")}
+    self.state = qa.QAState(state_path, self.keys.values()) if state_path else None
+    self.updates = []
+
+  # given a dict of path -> os.stat_result, returns lists of identical files
+  def find_duplicates(self, stats):
+    by_size = {}
+    for path, stat in stats.items():
+      by_size.setdefault(stat.st_size, []).append(path)
+    candidates = [path for paths in by_size.values() if len(paths) > 1 for path in paths]
+
+    with ThreadPoolExecutor(max_workers=self.workers) as pool:
+      duplicates = []
+      to_compare = []
+      for paths in self.group_by(pool, candidates, stats, "quick", self.quick_hash):
+        # small files were read in full by the quick hash already
+        if stats[paths[0]].st_size <= 2 * QUICK_HASH_BYTES:
+          duplicates.append(paths)
+        else:
+          to_compare.extend(paths)
+      duplicates.extend(self.group_by(pool, to_compare, stats, "full", self.file_to_hash))
+
+    for paths in duplicates:
+      paths.sort()
+    duplicates.sort()
+    return duplicates
+
+  # hash paths (or take the digest from the QA state), and return the groups
+  # of more than one path that share a size and digest
+  def group_by(self, pool, paths, stats, kind, hash_function):
+    digests = {}
+    to_hash = []
+    for path in paths:
+      digest = self.stored_digest(path, stats[path], kind)
+      if digest:
+        digests[path] = digest
+      else:
+        to_hash.append(path)
+
+    for path, digest in zip(to_hash, pool.map(hash_function, to_hash)):
+      digests[path] = digest
+      stat = stats[path]
+      self.updates.append((self.keys[kind], path, stat.st_size, stat.st_mtime,
+                           digest if kind == "full" else None, pickle.dumps(digest)))
+
+    groups = {}
+    for path, digest in digests.items():
+      groups.setdefault((stats[path].st_size, digest), []).append(path)
+    return [group for group in groups.values() if len(group) > 1]
+
+  def stored_digest(self, path, stat, kind):
+    if not self.state:
       return None
+    row = self.state.lookup(self.keys[kind], path)
+    if row and (row[0] == stat.st_size) and (row[1] == stat.st_mtime):
+      return pickle.loads(row[3])
+    return None
+
+  # store new digests, and forget files under the checked directories that are
+  # gone now
+  def save(self, checked_dirs, stats):
+    if not self.state:
+      return
+    seen = [(key, path) for path in stats for key in self.keys.values()]
+    self.state.walking(checked_dirs)
+    self.state.update(self.updates, seen)
+    self.state.prune()
+    self.updates = []
+
+  def close(self):
+    if self.state:
+      self.state.close()
+
+  def quick_hash(self, path):
+    hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+      hash.update(f.read(QUICK_HASH_BYTES))
+      f.seek(0, os.SEEK_END)
+      size = f.tell()
+      if size > QUICK_HASH_BYTES:
+        f.seek(max(QUICK_HASH_BYTES, size - QUICK_HASH_BYTES))
+        hash.update(f.read())
+    return hash.hexdigest()
 
   def file_to_hash(self, path):
     hash = hashlib.sha256()
@@ -25,28 +111,39 @@ class Deduplicator(object):
       while message != b'':
         message = f.read(1024 * 1024)
         hash.update(message)
-    return hash.digest()
+    return hash.hexdigest()
+
+class DuplicateFiles(qa.Check):
+  def start(self, options):
+    self.ig_list = options.get("inspectors")
+
+  # only the sizes are needed to start with, see Deduplicator
+  def visit_report(self, report):
+    return [(report.path_for(filename), report.stat(filename))
+            for filename in report.files]
+
+  def finish(self, results):
+    dedup = Deduplicator()
+    data_dir = utils.data_dir()
+    checked_dirs = [os.path.join(data_dir, inspector)
+                    for inspector in utils.inspector_names(data_dir, self.ig_list)]
+    stats = dict(results)
+
+    try:
+      for paths in dedup.find_duplicates(stats):
+        print("Duplicate files: " + ", ".join(paths))
+      dedup.save(checked_dirs, stats)
+    finally:
+      dedup.close()
+
+QA_CHECK = DuplicateFiles
 
 def run(options):
-  ig_list = options.get("inspectors")
-
-  dedup = Deduplicator()
-  data_dir = utils.data_dir()
-  for inspector in os.listdir(data_dir):
-    if not ig_list or inspector in ig_list:
-      logging.debug("[%s] Checking..." % inspector)
-
-      inspector_path = os.path.join(data_dir, inspector)
-      if os.path.isdir(inspector_path):
-        for dirpath, dirnames, filenames in os.walk(inspector_path):
-          for filename in filenames:
-            result = dedup.add_and_check_file(os.path.join(dirpath, filename))
-            if result:
-              print("Duplicate files: " + ", ".join(result))
+  qa.run_check(DuplicateFiles(), options)
 
 def main():
   import sys, os, os.path
   sys.path.append(os.getcwd())
   sys.path.append(os.path.abspath(".."))
-  run([])
+  run({})
 main() if (__name__ == "__main__") else None
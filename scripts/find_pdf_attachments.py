@@ -2,51 +2,135 @@
 
 import os, os.path, subprocess, tempfile, shutil
 import logging
-from inspectors.utils import utils
+import pdfrw
+from pdfrw import PdfName, PdfString
+from inspectors.utils import qa
+
+# PDFs are read in-process with pdfrw, from the QA engine's single read of
+# each file, on its worker processes. Attachments are either in the
+# /EmbeddedFiles name tree in the document catalog, or in file attachment
+# annotations on pages. pdfrw can't read encrypted PDFs, and gives up on
+# damaged ones that qpdf can repair (e.g. with a broken xref table), so those
+# are still decrypted or repaired with qpdf and unpacked with pdftk.
+#
+# PDFs larger than IN_MEMORY_BYTES aren't collected from the shared read,
+# but read by pdfrw from their path, so a worker only holds one copy of them.
+IN_MEMORY_BYTES = 16 * 1024 * 1024
+
+class PdfAttachments(qa.Check):
+  version = 3
+
+  def file_visitor(self, report, filename):
+    _, extension = os.path.splitext(filename.lower())
+    if extension == ".pdf":
+      stat = report.stat(filename)
+      in_memory = (stat is None) or (stat.st_size <= IN_MEMORY_BYTES)
+      return AttachmentFinder(report.path_for(filename), in_memory)
+
+
+class AttachmentFinder(qa.FileVisitor):
+  def __init__(self, original, in_memory=True):
+    self.original = original
+    self.chunks = []
+    if not in_memory:
+      self.max_bytes = 0
+
+  def update(self, chunk):
+    self.chunks.append(chunk)
+
+  def result(self):
+    try:
+      if self.max_bytes == 0:
+        pdf = pdfrw.PdfReader(self.original, verbose=False)
+      else:
+        data, self.chunks = b"".join(self.chunks), None
+        pdf = pdfrw.PdfReader(fdata=data, verbose=False)
+    except Exception:
+      logging.debug("pdfrw could not read %s, trying qpdf" % self.original)
+      return unpacked_attachments(self.original, repairing=True)
+    if pdf.Encrypt:
+      return unpacked_attachments(self.original)
+
+    attachments = attachment_names(pdf)
+    if attachments:
+      return ["%s has the following attachments: %s" % (self.original, ', '.join(attachments))]
+
+
+def attachment_names(pdf):
+  names = []
+  if pdf.Root.Names and pdf.Root.Names.EmbeddedFiles:
+    names.extend(embedded_file_names(pdf.Root.Names.EmbeddedFiles, set()))
+  for page in pdf.pages:
+    for annotation in page.Annots or []:
+      if (annotation.Subtype == PdfName.FileAttachment) and annotation.FS:
+        names.append(filespec_name(annotation.FS))
+  return names
+
+# the file names in a name tree, whose leaves hold [name, filespec, ...]
+def embedded_file_names(node, visited):
+  if id(node) in visited:
+    return []
+  visited.add(id(node))
+
+  names = []
+  if node.Names:
+    for filespec in node.Names[1::2]:
+      names.append(filespec_name(filespec))
+  for kid in node.Kids or []:
+    names.extend(embedded_file_names(kid, visited))
+  return names
+
+def filespec_name(filespec):
+  if isinstance(filespec, PdfString):
+    name = filespec
+  else:
+    name = filespec.UF or filespec.F
+  if isinstance(name, PdfString):
+    return name.to_unicode()
+  return str(name) if name else "(unnamed)"
+
+# repairing: whether this is the fallback for a PDF pdfrw couldn't read, in
+# which case a failure means it can't be read at all
+def unpacked_attachments(original, repairing=False):
+  try:
+    decrypted_file, decrypted_path = tempfile.mkstemp(suffix=".pdf")
+    os.close(decrypted_file)
+    decrypted_file = None
+    logging.debug("Decrypting %s to %s" % (original, decrypted_path))
+    subprocess.check_call(["qpdf", "--decrypt", original, decrypted_path])
+    try:
+      extract_dir = tempfile.mkdtemp()
+      logging.debug("Extracting %s to %s" % (decrypted_path, extract_dir))
+      subprocess.check_call(["pdftk", decrypted_path, "unpack_files"], cwd=extract_dir)
+      attachments = os.listdir(extract_dir)
+      if attachments:
+        return ["%s has the following attachments: %s" % (original, ', '.join(attachments))]
+    finally:
+      shutil.rmtree(extract_dir)
+  except subprocess.CalledProcessError as e:
+    if repairing:
+      return ["Could not read %s" % original]
+    return [str(e)]
+  except FileNotFoundError:
+    if repairing:
+      return ["Could not read %s (install qpdf and pdftk to try repairing it)" % original]
+    raise
+  finally:
+    try:
+      if decrypted_file:
+        os.close(decrypted_file)
+        decrypted_file = None
+    finally:
+      os.remove(decrypted_path)
+
+QA_CHECK = PdfAttachments
 
 def run(options):
-  ig_list = options.get("inspectors")
-
-  data_dir = utils.data_dir()
-  for inspector in os.listdir(data_dir):
-    if not ig_list or inspector in ig_list:
-      logging.debug("[%s] Checking..." % inspector)
-
-      inspector_path = os.path.join(data_dir, inspector)
-      if os.path.isdir(inspector_path):
-        for dirpath, dirnames, filenames in os.walk(inspector_path):
-          for filename in filenames:
-            _, extension = os.path.splitext(filename.lower())
-            if extension == ".pdf":
-              try:
-                original = os.path.join(dirpath, filename)
-                decrypted_file, decrypted_path = tempfile.mkstemp(suffix=".pdf")
-                os.close(decrypted_file)
-                decrypted_file = None
-                logging.debug("Decrypting %s to %s" % (original, decrypted_path))
-                subprocess.check_call(["qpdf", "--decrypt", original, decrypted_path])
-                try:
-                  extract_dir = tempfile.mkdtemp()
-                  logging.debug("Extracting %s to %s" % (decrypted_path, extract_dir))
-                  subprocess.check_call(["pdftk", decrypted_path, "unpack_files"], cwd=extract_dir)
-                  attachments = os.listdir(extract_dir)
-                  if attachments:
-                    print("%s has the following attachments: %s" % (original, ', '.join(attachments)))
-                finally:
-                  shutil.rmtree(extract_dir)
-              except subprocess.CalledProcessError as e:
-                print(e)
-              finally:
-                try:
-                  if decrypted_file:
-                    os.close(decrypted_file)
-                    decrypted_file = None
-                finally:
-                  os.remove(decrypted_path)
+  qa.run_check(PdfAttachments(), options)
 
 def main():
   import sys, os, os.path
   sys.path.append(os.getcwd())
   sys.path.append(os.path.abspath(".."))
-  run([])
+  run({})
 main() if (__name__ == "__main__") else None
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+import re
+import zlib
+import numpy
+from inspectors.utils import qa
+
+# Finds reports whose extracted text is nearly the same, e.g. a report that
+# was re-posted with a new cover page, uploaded under two regions, or also
+# saved from governmentattic.org.
+#
+# Each report.txt is broken into overlapping runs of SHINGLE_SIZE words, and a
+# MinHash signature of NUM_PERMUTATIONS values is computed from those shingles.
+# The signatures are split into BANDS bands, and reports that share any band
+# exactly become candidate pairs (locality sensitive hashing), so reports are
+# never compared all against all. Candidates whose signatures agree on at
+# least SIMILARITY_THRESHOLD of their values are reported.
+
+SHINGLE_SIZE = 5
+NUM_PERMUTATIONS = 128
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+SIMILARITY_THRESHOLD = 0.8
+
+# texts with fewer shingles than this (failed extractions, scanned images)
+# would all look alike, so they are left out
+MIN_SHINGLES = 50
+
+# hash shingles in blocks, to bound the size of the permutation matrix
+BLOCK_SIZE = 8192
+
+MERSENNE_PRIME = (1 << 31) - 1
+MAX_HASH = numpy.uint64(MERSENNE_PRIME)
+
+WORD_RE = re.compile("[a-z0-9]+")
+
+
+class MinHasher(object):
+  def __init__(self, num_permutations=NUM_PERMUTATIONS, seed=1):
+    generator = numpy.random.RandomState(seed)
+    self.a = generator.randint(1, MERSENNE_PRIME, size=(num_permutations, 1)).astype(numpy.uint64)
+    self.b = generator.randint(0, MERSENNE_PRIME, size=(num_permutations, 1)).astype(numpy.uint64)
+
+  def shingle_hashes(self, text):
+    words = WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+      return numpy.zeros(0, dtype=numpy.uint64)
+
+    word_hashes = numpy.fromiter((zlib.crc32(word.encode("utf-8")) for word in words),
+                                 dtype=numpy.uint64, count=len(words))
+
+    # combine each run of SHINGLE_SIZE word hashes into one shingle hash
+    count = len(words) - SHINGLE_SIZE + 1
+    hashes = numpy.zeros(count, dtype=numpy.uint64)
+    for offset in range(SHINGLE_SIZE):
+      hashes = (hashes * numpy.uint64(1000003) + word_hashes[offset:offset + count]) % MAX_HASH
+
+    return numpy.unique(hashes)
+
+  def signature(self, hashes):
+    signature = numpy.full(len(self.a), MAX_HASH, dtype=numpy.uint64)
+    for start in range(0, len(hashes), BLOCK_SIZE):
+      block = hashes[start:start + BLOCK_SIZE][numpy.newaxis, :]
+      permuted = (self.a * block + self.b) % MAX_HASH
+      signature = numpy.minimum(signature, permuted.min(axis=1))
+    return signature.astype(numpy.uint32)
+
+
+class NearDuplicates(qa.Check):
+  def __init__(self):
+    self.hasher = MinHasher()
+
+  def file_visitor(self, report, filename):
+    if filename == "report.txt":
+      return TextSignature(self.hasher, report.path_for(filename))
+
+  def finish(self, results):
+    if not results:
+      return
+
+    paths = [path for path, signature in results]
+    signatures = numpy.vstack([signature for path, signature in results])
+    for (first, second), similarity in near_duplicate_pairs(signatures):
+      print("Near-duplicate reports (%d%% similar): %s, %s" %
+            (similarity * 100, paths[first], paths[second]))
+
+
+# computes a report.txt's signature, in the worker process that reads it
+class TextSignature(qa.FileVisitor):
+  def __init__(self, hasher, path):
+    self.hasher = hasher
+    self.path = path
+    self.chunks = []
+
+  def update(self, chunk):
+    self.chunks.append(chunk)
+
+  def result(self):
+    text = b"".join(self.chunks).decode("utf-8", errors="replace")
+    hashes = self.hasher.shingle_hashes(text)
+    if len(hashes) < MIN_SHINGLES:
+      return None
+    return [(self.path, self.hasher.signature(hashes))]
+
+QA_CHECK = NearDuplicates
+
+def run(options):
+  qa.run_check(NearDuplicates(), options)
+
+
+def near_duplicate_pairs(signatures):
+  candidates = set()
+  for band in range(BANDS):
+    buckets = {}
+    band_values = signatures[:, band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+    for index, row in enumerate(band_values):
+      buckets.setdefault(row.tobytes(), []).append(index)
+    for bucket in buckets.values():
+      for i in range(len(bucket)):
+        for j in range(i + 1, len(bucket)):
+          candidates.add((bucket[i], bucket[j]))
+
+  pairs = []
+  for first, second in sorted(candidates):
+    similarity = numpy.mean(signatures[first] == signatures[second])
+    if similarity >= SIMILARITY_THRESHOLD:
+      pairs.append(((first, second), similarity))
+  return pairs
+
+
+def main():
+  import sys, os, os.path
+  sys.path.append(os.getcwd())
+  sys.path.append(os.path.abspath(".."))
+  run({})
+main() if (__name__ == "__main__") else None
@@ -1,8 +1,7 @@
 #!/usr/bin/env python
 
-import os, os.path
 import re
-from inspectors.utils import utils
+from inspectors.utils import utils, qa
 import logging
 import scrapelib
 
@@ -10,6 +9,24 @@ PAGE_NOT_FOUND_PATTERN = b"(<title>(404 Page Not Found - CFTC|CPB: Page Not Foun
 PAGE_NOT_FOUND_BYTES_RE = re.compile(PAGE_NOT_FOUND_PATTERN)
 PAGE_NOT_FOUND_STRING_RE = re.compile(PAGE_NOT_FOUND_PATTERN.decode('ascii'))
 
+# Saved files are checked the way Soft404HttpAdapter checks pages as they're
+# downloaded: only the start of each file is read, and searched as bytes.
+SEARCH_BYTES = utils.Soft404HttpAdapter.SOFT_404_SEARCH_BYTES
+
+# files that start with one of these are real documents or images, not error
+# pages, whatever their extension (PDF, ZIP/.docx, OLE/.doc, PNG, GIF, JPEG,
+# TIFF)
+BINARY_SIGNATURES = (
+  b"%PDF",
+  b"PK\x03\x04",
+  b"\xd0\xcf\x11\xe0",
+  b"\x89PNG",
+  b"GIF8",
+  b"\xff\xd8\xff",
+  b"II*\x00",
+  b"MM\x00*",
+)
+
 URLS = {
   'smithsonian': 'https://www.si.edu/OIG/doesyour404work',
 }
@@ -27,54 +44,65 @@ IGS_WITH_BAD_404 = (
 )
 
 
-def run(options):
+class Soft404(qa.Check):
+  inspectors = IGS_WITH_BAD_404
+
+  # make sure the soft 404 handling still recognizes these sites' error pages
+  def start(self, options):
+    ig_list = options.get("inspectors")
+
+    for inspector, url in URLS.items():
+      if (not ig_list) or (inspector in ig_list):
+        logging.debug("[%s] Checking..." % inspector)
+        result = None
+        status_code_rewritten = False
+        while True:
+          try:
+            verify_options = utils.domain_verify_options(url)
+            response = utils.scraper.get(url, verify=verify_options)
+            result = response.text
+            break
+          except scrapelib.HTTPError as e:
+            if e.response.status_code == 404:
+              status_code_rewritten = True
+              if 'location' in e.response.headers:
+                url = e.response.headers['location']
+                continue
+            result = e.body
+            break
+
+        if not status_code_rewritten:
+          print("False negative for %s (handler did not rewrite error code)" %
+                inspector)
+
+        match = PAGE_NOT_FOUND_STRING_RE.search(result)
+        if not match:
+          print("False negative for %s (regular expression did not match error "
+                "page contents)" % inspector)
+
+  def file_visitor(self, report, filename):
+    return Soft404Scan(report.path_for(filename))
 
-  ig_list = options.get("inspectors")
-
-  for inspector, url in URLS.items():
-    if (not ig_list) or (inspector in ig_list):
-      logging.debug("[%s] Checking..." % inspector)
-      result = None
-      status_code_rewritten = False
-      while True:
-        try:
-          verify_options = utils.domain_verify_options(url)
-          response = utils.scraper.get(url, verify=verify_options)
-          result = response.text
-          break
-        except scrapelib.HTTPError as e:
-          if e.response.status_code == 404:
-            status_code_rewritten = True
-            if 'location' in e.response.headers:
-              url = e.response.headers['location']
-              continue
-          result = e.body
-          break
-
-      if not status_code_rewritten:
-        print("False negative for %s (handler did not rewrite error code)" %
-              inspector)
-
-      match = PAGE_NOT_FOUND_STRING_RE.search(result)
-      if not match:
-        print("False negative for %s (regular expression did not match error "
-              "page contents)" % inspector)
-
-  data_dir = utils.data_dir()
-  for inspector in os.listdir(data_dir):
-    if (not ig_list or inspector in ig_list) and inspector in IGS_WITH_BAD_404:
-      inspector_path = os.path.join(data_dir, inspector)
-      if os.path.isdir(inspector_path):
-        for dirpath, dirnames, filenames in os.walk(inspector_path):
-          for filename in filenames:
-            path = os.path.join(dirpath, filename)
-            try:
-              f = open(path, 'r', encoding='utf-8')
-              for line in f:
-                if PAGE_NOT_FOUND_STRING_RE.search(line):
-                  print("Soft 404 found: %s" % path)
-            except UnicodeDecodeError:
-              f = open(path, 'rb')
-              for line in f:
-                if PAGE_NOT_FOUND_BYTES_RE.search(line):
-                  print("Soft 404 found: %s" % path)
+
+class Soft404Scan(qa.FileVisitor):
+  max_bytes = SEARCH_BYTES
+
+  def __init__(self, path):
+    self.path = path
+    self.chunks = []
+
+  def update(self, chunk):
+    self.chunks.append(chunk)
+
+  def result(self):
+    head = b"".join(self.chunks)
+    if head.startswith(BINARY_SIGNATURES):
+      return None
+    if PAGE_NOT_FOUND_BYTES_RE.search(head):
+      return ["Soft 404 found: %s" % self.path]
+
+
+QA_CHECK = Soft404
+
+def run(options):
+  qa.run_check(Soft404(), options)
@@ -1,41 +1,51 @@
 #!/usr/bin/env python
 
 import sys, os, os.path, json
-from inspectors.utils import utils
-import logging
+from inspectors.utils import qa
+
+class UniqueReportIds(qa.Check):
+  def start(self, options):
+    self.check_globally = "global" in options
+
+  def file_visitor(self, report, filename):
+    if filename == "report.json":
+      return ReportIdReader(report.inspector, report.path_for(filename))
+
+  def finish(self, results):
+    report_id_history = {}
+    last_inspector = None
+    for inspector, report_id, json_path in results:
+      if (inspector != last_inspector) and not self.check_globally:
+        report_id_history = {}
+      last_inspector = inspector
+
+      if report_id in report_id_history:
+        report_id_history[report_id].append(json_path)
+        print("Duplicate report_id %s in %s" % (repr(report_id), ", ".join(report_id_history[report_id])))
+      else:
+        report_id_history[report_id] = [json_path]
+
+class ReportIdReader(qa.FileVisitor):
+  def __init__(self, inspector, json_path):
+    self.inspector = inspector
+    self.json_path = json_path
+    self.chunks = []
+
+  def update(self, chunk):
+    self.chunks.append(chunk)
+
+  def result(self):
+    report_data = json.loads(b"".join(self.chunks).decode("utf-8"))
+    return [(self.inspector, report_data["report_id"], self.json_path)]
+
+QA_CHECK = UniqueReportIds
 
 def run(options):
-  data_dir = utils.data_dir()
-  ig_list = options.get("inspectors")
-
-  report_id_history = {}
-  for inspector in os.listdir(data_dir):
-    logging.debug("[%s] Checking..." % inspector)
-
-    if not ig_list or inspector in ig_list:
-      inspector_path = os.path.join(data_dir, inspector)
-      if os.path.isdir(inspector_path):
-        for year in os.listdir(inspector_path):
-          year_path = os.path.join(inspector_path, year)
-          if os.path.isdir(year_path):
-            for report in os.listdir(year_path):
-              report_path = os.path.join(year_path, report)
-              if os.path.isdir(report_path):
-                json_path = os.path.join(report_path, "report.json")
-                if os.path.isfile(json_path):
-                  report_data = json.load(open(json_path, "r", encoding="utf-8"))
-                  report_id = report_data["report_id"]
-                  if report_id in report_id_history:
-                    report_id_history[report_id].append(json_path)
-                    print("Duplicate report_id %s in %s" % (repr(report_id), ", ".join(report_id_history[report_id])))
-                  else:
-                    report_id_history[report_id] = [json_path]
-        if "global" not in options:
-          report_id_history = {}
+  qa.run_check(UniqueReportIds(), options)
 
 def main():
   sys.path.append(os.getcwd())
   sys.path.append(os.path.abspath(".."))
-  run([]) #?
+  run({})
 
 main() if (__name__ == "__main__") else None
@@ -0,0 +1,124 @@
+# A local stand-in for the Internet Archive, for testing the backup script.
+#
+# FakeArchive is an HTTP server on localhost with the endpoints the
+# internetarchive library uses to back up a report: GET /metadata/<item>
+# (an empty object for items that don't exist), PUT /<item>/<filename> for
+# uploads, with the item's metadata in x-archive-meta* headers like IA's S3
+# API, and GET /?check_limit=1, which the library asks before retrying an
+# upload. It can be told to fail the next few uploads for an item with a 503,
+# like S3 does when it's overloaded, and records the largest number of
+# requests it was handling at once.
+#
+# Its adapter sends the requests of a real internetarchive session to it, in
+# place of archive.org and s3.us.archive.org.
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, urlunsplit
+
+from requests.adapters import HTTPAdapter
+
+
+class FakeArchive(object):
+  def __init__(self, delay=0.0):
+    self.items = {}
+    self.failures = {}
+    self.delay = delay
+    self.lock = threading.Lock()
+    self.active = 0
+    self.max_active = 0
+    self.requests = 0
+
+    archive = self
+    class Handler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        archive.handle(self, "GET")
+
+      def do_PUT(self):
+        archive.handle(self, "PUT")
+
+      def log_message(self, *args):
+        pass
+
+    self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    self.url = "http://127.0.0.1:%i" % self.server.server_address[1]
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    self.adapter = LocalAdapter(self.url)
+
+  def __enter__(self):
+    self.thread.start()
+    return self
+
+  def __exit__(self, *args):
+    self.server.shutdown()
+    self.server.server_close()
+
+  # fail the next count uploads to an item with a 503
+  def fail(self, item_id, count):
+    self.failures[item_id] = count
+
+  def handle(self, request, method):
+    with self.lock:
+      self.active += 1
+      self.requests += 1
+      self.max_active = max(self.max_active, self.active)
+    try:
+      time.sleep(self.delay)
+      path = request.path.split("?")[0]
+      parts = path.strip("/").split("/")
+
+      if method == "GET":
+        if parts == [""]:
+          return self.respond(request, 200, {"over_limit": 0})
+        return self.respond(request, 200, self.items.get(parts[1], {}))
+
+      item_id = parts[0]
+      with self.lock:
+        failing = self.failures.get(item_id, 0)
+        if failing:
+          self.failures[item_id] = failing - 1
+      if failing:
+        return self.respond(request, 503, {"error": "SlowDown"})
+
+      length = int(request.headers.get("Content-Length", 0))
+      body = request.rfile.read(length)
+      # x-archive-meta-<name>, or x-archive-meta<index>-<name> for each of
+      # several values
+      metadata = {}
+      for key, value in request.headers.items():
+        match = re.match(r"x-archive-meta(\d*)-(.+)$", key.lower())
+        if match:
+          metadata[match.group(2).replace("--", "_")] = value
+      with self.lock:
+        item = self.items.setdefault(item_id, {"metadata": {}, "files": {}})
+        item["metadata"].update(metadata)
+        item["files"][parts[1]] = body
+      self.respond(request, 200, {})
+    finally:
+      with self.lock:
+        self.active -= 1
+
+  def respond(self, request, status, body):
+    if "files" in body:
+      body = {"metadata": body["metadata"], "files": [{"name": name} for name in body["files"]]}
+    content = json.dumps(body).encode("utf-8")
+    request.send_response(status)
+    request.send_header("Content-Type", "application/json")
+    request.send_header("Content-Length", str(len(content)))
+    request.end_headers()
+    request.wfile.write(content)
+
+
+# sends each request to the FakeArchive at url, instead of the host it's for
+class LocalAdapter(HTTPAdapter):
+  def __init__(self, url):
+    super().__init__()
+    self.url = urlsplit(url)
+
+  def send(self, request, **kwargs):
+    parts = urlsplit(request.url)
+    request.url = urlunsplit((self.url.scheme, self.url.netloc) + tuple(parts[2:]))
+    return super().send(request, **kwargs)
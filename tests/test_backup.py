@@ -0,0 +1,159 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "inspectors"))
+sys.path.append(os.path.join(ROOT, "scripts", "backup"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils import utils
+from fake_ia import FakeArchive
+
+try:
+  import internetarchive
+  from internetarchive.session import ArchiveSession
+  import ia
+except ImportError:
+  internetarchive = None
+
+NO_WAITING = utils.RetryPolicy(attempts=3, base_delay=0, max_delay=0)
+
+OPTIONS = {'config': {'access_key': "access", 'secret_key': "secret"}}
+
+
+@unittest.skipIf(internetarchive is None, "needs the internetarchive library")
+class BackupTest(unittest.TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.dir = tempfile.mkdtemp()
+    os.chdir(self.dir)
+    ia.manifest = ia.Manifest(ia.MANIFEST_PATH)
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    shutil.rmtree(self.dir)
+
+  def add_report(self, ig, year, report_id):
+    directory = os.path.join("data", ig, year, report_id)
+    os.makedirs(directory)
+    report = {
+      'report_id': report_id, 'inspector': ig, 'inspector_url': "https://example.gov/",
+      'title': "Report %s" % report_id, 'published_on': "%s-01-01" % year, 'year': int(year),
+      'file_type': "pdf", 'url': "https://example.gov/%s.pdf" % report_id,
+    }
+    with open(os.path.join(directory, "report.json"), "w") as f:
+      json.dump(report, f)
+    with open(os.path.join(directory, "report.pdf"), "wb") as f:
+      f.write(b"%PDF-1.4 " + report_id.encode("utf-8"))
+    return (ig, year, report_id)
+
+  # the sessions internetarchive opens send their requests to the fake
+  # archive, and don't wait between the library's own retries either
+  def backup(self, archive, reports, jobs=1, **options):
+    with mock.patch.object(ArchiveSession, "get_adapter", lambda session, url: archive.adapter), \
+        mock.patch.object(internetarchive.item, "sleep", lambda seconds: None):
+      return ia.backup_reports(reports, dict(OPTIONS, **options), jobs=jobs, policy=NO_WAITING)
+
+  def test_uploads_reports_in_parallel(self):
+    reports = [self.add_report("dod", "2014", "report-%i" % i) for i in range(6)]
+    with FakeArchive(delay=0.1) as archive:
+      errors = self.backup(archive, reports, jobs=3)
+
+    self.assertEqual(errors, [])
+    self.assertGreater(archive.max_active, 1)
+    self.assertLessEqual(archive.max_active, 3)
+    for ig, year, report_id in reports:
+      item = archive.items[ia.item_id_for(ig, year, report_id)]
+      self.assertEqual(sorted(item["files"].keys()), ["report.json", "report.pdf"])
+      self.assertEqual(item["metadata"]["report-id"], report_id)
+      self.assertTrue(ia.already_uploaded(ig, year, report_id))
+
+  def test_retries_failed_uploads(self):
+    report = self.add_report("dod", "2014", "flaky")
+    with FakeArchive() as archive:
+      # more than internetarchive retries an upload itself
+      archive.fail(ia.item_id_for(*report), 5)
+      errors = self.backup(archive, [report])
+
+    self.assertEqual(errors, [])
+    self.assertIn(ia.item_id_for(*report), archive.items)
+    self.assertTrue(ia.already_uploaded(*report))
+
+  def test_gives_up_after_the_last_attempt(self):
+    good = self.add_report("dod", "2014", "good")
+    bad = self.add_report("dod", "2014", "down")
+    with FakeArchive() as archive:
+      archive.fail(ia.item_id_for(*bad), 100)
+      errors = self.backup(archive, [good, bad], jobs=2)
+
+    self.assertEqual(errors, [bad])
+    self.assertTrue(ia.already_uploaded(*good))
+    self.assertFalse(ia.already_uploaded(*bad))
+
+  def test_skips_uploaded_reports(self):
+    report = self.add_report("dod", "2014", "once")
+    with FakeArchive() as archive:
+      self.backup(archive, [report])
+      requests = archive.requests
+      ia.manifest = ia.Manifest(ia.MANIFEST_PATH)
+      errors = self.backup(archive, [report])
+
+    self.assertEqual(errors, [])
+    self.assertEqual(archive.requests, requests)
+
+  def test_uploads_changed_reports_again(self):
+    report = self.add_report("dod", "2014", "changed")
+    with FakeArchive() as archive:
+      self.backup(archive, [report])
+      with open(os.path.join(ia.report_dir(*report), "report.pdf"), "wb") as f:
+        f.write(b"%PDF-1.4 a corrected version")
+      self.assertFalse(ia.already_uploaded(*report))
+      errors = self.backup(archive, [report])
+
+    self.assertEqual(errors, [])
+    item = archive.items[ia.item_id_for(*report)]
+    self.assertEqual(item["files"]["report.pdf"], b"%PDF-1.4 a corrected version")
+    self.assertTrue(ia.already_uploaded(*report))
+
+  def test_sends_report_files_after_a_metadata_upload(self):
+    report = self.add_report("dod", "2014", "meta")
+    with FakeArchive() as archive:
+      self.backup(archive, [report], meta=True)
+      self.assertEqual(list(archive.items[ia.item_id_for(*report)]["files"].keys()), ["report.json"])
+      self.assertFalse(ia.already_uploaded(*report))
+
+      errors = self.backup(archive, [report])
+
+    self.assertEqual(errors, [])
+    self.assertIn("report.pdf", archive.items[ia.item_id_for(*report)]["files"])
+    self.assertTrue(ia.already_uploaded(*report))
+
+  def test_dry_runs_record_nothing(self):
+    report = self.add_report("dod", "2014", "dry")
+    with FakeArchive() as archive:
+      errors = self.backup(archive, [report], dry_run=True)
+
+    self.assertEqual(errors, [])
+    self.assertEqual(archive.items, {})
+    self.assertIsNone(ia.manifest.get(ia.item_id_for(*report)))
+
+  def test_trusts_legacy_markers(self):
+    report = self.add_report("dod", "2014", "legacy")
+    open(ia.marker_path(*report), "w").close()
+
+    self.assertTrue(ia.already_uploaded(*report))
+    entry = ia.manifest.get(ia.item_id_for(*report))
+    self.assertIsNone(entry["sha256"])
+
+    with open(os.path.join(ia.report_dir(*report), "report.pdf"), "ab") as f:
+      f.write(b" and more")
+    self.assertFalse(ia.already_uploaded(*report))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,77 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Runs ./bulk over a data directory of its own, building the archive, then
+# again after some reports change, when most entries are copied over from the
+# archive it's replacing.
+class BulkTest(unittest.TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.dir = tempfile.mkdtemp()
+    os.chdir(self.dir)
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    shutil.rmtree(self.dir)
+
+  def write(self, path, content, mtime=None):
+    path = os.path.join("data", path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+      f.write(content)
+    if mtime:
+      os.utime(path, (mtime, mtime))
+
+  def bulk(self, *args):
+    env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, "inspectors"))
+    result = subprocess.run([sys.executable, os.path.join(ROOT, "bulk")] + list(args),
+                            env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    self.assertEqual(result.returncode, 0, result.stdout)
+    return result.stdout.decode("utf-8")
+
+  # the archive is valid, and has exactly the files in the data directory
+  def assertArchived(self, path):
+    with zipfile.ZipFile(path) as archive:
+      self.assertIsNone(archive.testzip())
+      expected = {}
+      for directory, subdirectories, files in os.walk("data"):
+        for filename in files:
+          name = os.path.relpath(os.path.join(directory, filename), "data").replace(os.sep, "/")
+          with open(os.path.join(directory, filename), "rb") as f:
+            expected[name] = f.read()
+      self.assertEqual(dict((name, archive.read(name)) for name in archive.namelist()), expected)
+
+  def test_builds_an_archive_incrementally(self):
+    earlier = time.time() - 3600
+    for i in range(4):
+      self.write("dod/2014/report-%i/report.json" % i, b'{"report_id": "report-%i"}' % i, earlier)
+      self.write("dod/2014/report-%i/report.pdf" % i, os.urandom(20000), earlier)
+      self.write("dod/2014/report-%i/report.txt" % i, b"some text " * 2000, earlier)
+
+    output = self.bulk("--output=Out/Bulk.zip")
+    self.assertIn("(0 unchanged, 12 added)", output)
+    self.assertArchived("Out/Bulk.zip")
+
+    self.write("dod/2014/report-1/report.txt", b"corrected text " * 2000)
+    self.write("dod/2015/report-4/report.json", b'{"report_id": "report-4"}')
+    output = self.bulk("--output=Out/Bulk.zip", "--delta")
+    self.assertIn("(11 unchanged, 2 added)", output)
+    self.assertArchived("Out/Bulk.zip")
+
+    with zipfile.ZipFile("Out/Bulk.delta.zip") as delta:
+      self.assertIsNone(delta.testzip())
+      self.assertEqual(sorted(delta.namelist()),
+                       ["dod/2014/report-1/report.txt", "dod/2015/report-4/report.json"])
+
+
+if __name__ == "__main__":
+  unittest.main()
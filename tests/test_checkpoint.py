@@ -0,0 +1,110 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "inspectors"))
+
+from bs4 import BeautifulSoup
+from utils import inspector
+import gaoreports
+
+# one listing page, with no link to a next page
+PAGE = "".join("<div class='listing'>%s</div>" % report_id for report_id in ("a", "b", "c", "d"))
+
+OPTIONS = {'year': "2004"}
+
+
+def report_for(report_id):
+  return {
+    'inspector': "gaoreports", 'inspector_url': "https://www.gao.gov",
+    'agency': "gaoreports", 'agency_name': "Government Accountability Office",
+    'report_id': report_id, 'title': "Report %s" % report_id, 'type': "report",
+    'published_on': "2004-01-01", 'url': "https://www.gao.gov/%s.pdf" % report_id,
+  }
+
+
+class ResumeTest(unittest.TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.dir = tempfile.mkdtemp()
+    os.chdir(self.dir)
+    inspector.ReportIdCache.reset()
+
+    # save_report() reads its options from the command line
+    patch = mock.patch.object(sys, "argv", ["gaoreports", "--dry_run", "--quick"])
+    patch.start()
+    self.addCleanup(patch.stop)
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    shutil.rmtree(self.dir)
+
+  # scrapes the listing page, dying at the report crash_at, and returns the
+  # IDs of the reports written
+  def scrape(self, options, crash_at=None):
+    written = []
+    def process_report(listing, details):
+      if listing == crash_at:
+        raise Exception("Died at %s" % listing)
+      return report_for(listing)
+    def write_report(report):
+      written.append(report['report_id'])
+      return "data/%s" % report['report_id']
+
+    with mock.patch.object(gaoreports, "fetch_listing", lambda url: BeautifulSoup(PAGE, "html.parser")), \
+        mock.patch.object(gaoreports, "listing_from", lambda result, year_range: result.text), \
+        mock.patch.object(gaoreports, "fetch_api_details", lambda listing: None), \
+        mock.patch.object(gaoreports, "process_report", process_report), \
+        mock.patch.object(inspector, "write_report", write_report):
+      checkpoint = inspector.Checkpoint("gaoreports", options)
+      try:
+        gaoreports.scrape_reports(options, checkpoint)
+      except Exception:
+        pass
+      checkpoint.saved_file.close()
+      inspector.Checkpoint.active.clear()
+    return written
+
+  def test_resuming_mid_page_skips_saved_reports(self):
+    self.assertEqual(self.scrape(OPTIONS, crash_at="c"), ["a", "b"])
+
+    inspector.ReportIdCache.reset()
+    resumed = dict(OPTIONS, resume=True)
+    self.assertEqual(self.scrape(resumed), ["c", "d"])
+
+  def test_moving_on_forgets_saved_reports(self):
+    checkpoint = inspector.Checkpoint("gaoreports", OPTIONS)
+    checkpoint.save(year=2004, offset=0)
+    checkpoint.report_saved("a")
+    checkpoint.saved_file.close()
+
+    checkpoint = inspector.Checkpoint("gaoreports", dict(OPTIONS, resume=True))
+    checkpoint.save(year=2004, offset=0)
+    self.assertTrue(checkpoint.was_saved("a"))
+    checkpoint.save(year=2004, offset=50)
+    self.assertFalse(checkpoint.was_saved("a"))
+    checkpoint.done()
+
+  def test_years_have_their_own_checkpoints(self):
+    first = inspector.Checkpoint("gaoreports", {'year': "2004"})
+    first.save(year=2004, offset=50)
+    first.report_saved("a")
+
+    # a sibling run, started without --resume, leaves it alone
+    second = inspector.Checkpoint("gaoreports", {'year': "2005"})
+    second.save(year=2005, offset=0)
+    second.done()
+    first.saved_file.close()
+
+    resumed = inspector.Checkpoint("gaoreports", {'year': "2004", 'resume': True})
+    self.assertEqual(resumed.get("offset"), 50)
+    self.assertTrue(resumed.was_saved("a"))
+    resumed.done()
+
+
+if __name__ == "__main__":
+  unittest.main()